@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+import os
+import glob
+import json
+import time
+import asyncio
+import logging
+import argparse
+from logger import configure_logging
+import http_client
+from completion_batcher import CompletionBatcher
+from replica_pool import ReplicaPool, replica_urls
+from process import ParseFile
+from metrics import Metrics
+from config import (
+    TEST_MODE, API_URL, API_REPLICAS, BATCH_OUTPUT_DIR, BATCH_WORKERS, PIPELINE_CONCURRENCY,
+    COMPLETION_BATCH_SIZE, COMPLETION_BATCH_WAIT
+)
+
+logger = logging.getLogger(__name__)
+
+def find_documents(pattern):
+    """Expands a directory (every *.txt in it) or a glob into a sorted file list."""
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.txt')
+    return sorted(path for path in glob.glob(pattern) if os.path.isfile(path))
+
+def output_path(document, output_dir):
+    base_name = os.path.splitext(os.path.basename(document))[0]
+    return os.path.join(output_dir, f'{base_name}_formatted.txt')
+
+def input_signature(document):
+    stat = os.stat(document)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def load_done(document, output_file):
+    """
+    The result recorded when document was last formatted into output_file, or
+    None when it has not finished since the document last changed.
+    """
+    done_file = output_file + '.done.json'
+    if not os.path.exists(output_file) or not os.path.exists(done_file):
+        return None
+    with open(done_file, 'r', encoding='utf-8') as f:
+        done = json.load(f)
+    if done.get("input") != input_signature(document):
+        return None
+    return done["result"]
+
+def save_done(document, output_file, result):
+    with open(output_file + '.done.json', 'w', encoding='utf-8') as f:
+        json.dump({"input": input_signature(document), "result": result}, f)
+
+async def process_document(document, output_dir, concurrency, batcher, pool, resume):
+    output_file = output_path(document, output_dir)
+    if resume:
+        # Finished documents have no checkpoint left; skip them instead of starting over
+        done = load_done(document, output_file)
+        if done is not None:
+            logger.info(f'{document} already formatted, skipping')
+            return dict(done, skipped=True), Metrics()
+
+    start_time = time.monotonic()
+    result = {"document": document, "output": output_file}
+    parser = ParseFile(concurrency=concurrency, batcher=batcher, pool=pool)
+    try:
+        async with parser:
+            await parser.process(
+                document,
+                resume=resume,
+                output_file=output_file,
+                checkpoint_file=output_file + '.checkpoint.json',
+                diagnostics=False
+            )
+        result.update(status="ok", words=parser.input_word_pointer, chunks=parser.chunk_count,
+                      retries=parser.retry_count, overlap_tokens_saved=parser.overlap_tokens_saved)
+    except Exception as e:
+        logger.error(f'{document} failed: {e}')
+        result.update(status="failed", error=str(e))
+    result["seconds"] = round(time.monotonic() - start_time, 3)
+    if result["status"] == "ok":
+        save_done(document, output_file, result)
+    return result, parser.metrics
+
+async def run_batch(documents, output_dir, workers, concurrency, resume):
+    """
+    Formats documents with a bounded pool of workers. Every worker shares the
+    pooled HTTP session, replica pool (and the prompt batcher when
+    COMPLETION_BATCH_SIZE > 1), so chunks from different documents interleave
+    on the servers and are balanced across all of them.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    queue = asyncio.Queue()
+    for document in documents:
+        queue.put_nowait(document)
+
+    pool = ReplicaPool(replica_urls(API_URL, API_REPLICAS))
+    batcher = None
+    if COMPLETION_BATCH_SIZE > 1:
+        poster = ParseFile(use_cache=False, pool=pool)
+        poster.session = await http_client.get_session()
+        batcher = CompletionBatcher(poster.post_completion, COMPLETION_BATCH_SIZE, COMPLETION_BATCH_WAIT)
+
+    results = []
+    metrics = Metrics()
+
+    async def worker():
+        while True:
+            try:
+                document = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            logger.info(f'Formatting {document}')
+            result, document_metrics = await process_document(document, output_dir, concurrency, batcher, pool, resume)
+            result["metrics"] = document_metrics.summary()
+            metrics.merge(document_metrics)
+            results.append(result)
+
+    start_time = time.monotonic()
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(workers, len(documents))))))
+    finally:
+        await http_client.close_session()
+    elapsed = time.monotonic() - start_time
+
+    results.sort(key=lambda result: result["document"])
+    summary = {
+        "documents": len(results),
+        "succeeded": sum(1 for result in results if result["status"] == "ok"),
+        "failed": sum(1 for result in results if result["status"] != "ok"),
+        "words": sum(result.get("words", 0) for result in results),
+        "seconds": round(elapsed, 3),
+        "metrics": metrics.summary(),
+        "replicas": pool.summary(),
+        "results": results
+    }
+    summary["words_per_second"] = round(summary["words"] / elapsed, 1) if elapsed else 0.0
+    with open(os.path.join(output_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description="Format every document in a directory or glob.")
+    parser.add_argument("inputs", help="directory of .txt files or a glob pattern")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR, help="where formatted documents are written")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="documents formatted at once")
+    parser.add_argument("--concurrency", type=int, default=PIPELINE_CONCURRENCY,
+                        help="chunks in flight per document")
+    parser.add_argument("--resume", action="store_true", help="skip finished documents and continue the rest from their checkpoints")
+    args = parser.parse_args()
+
+    configure_logging()
+    if TEST_MODE == "desiredoutput":
+        raise SystemExit("Batch processing does not support desiredoutput mode; DESIRED_OUTPUT names a single document")
+
+    documents = find_documents(args.inputs)
+    if not documents:
+        raise SystemExit(f"No documents match {args.inputs}")
+
+    summary = asyncio.run(run_batch(documents, args.output_dir, args.workers, args.concurrency, args.resume))
+
+    for result in summary["results"]:
+        detail = f'{result.get("words", 0)} words in {result["seconds"]}s' if result["status"] == "ok" else result["error"]
+        if result.get("skipped"):
+            detail += ' (already done)'
+        print(f'{result["status"]:>6}  {result["document"]}: {detail}')
+    print(f'{summary["succeeded"]}/{summary["documents"]} documents, '
+          f'{summary["words_per_second"]} words/s overall')
+    if summary["failed"]:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# benchmark.py
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from logger import configure_logging
+import http_client
+import mock_server
+from batch_process import find_documents, output_path
+from process import ParseFile
+from config import BENCHMARK_DOCUMENTS, BENCHMARK_OUTPUT_DIR, PIPELINE_CONCURRENCY
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+class TimedParseFile(ParseFile):
+    """ParseFile that records the latency of every chunk."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chunk_latencies = []
+
+    async def formatchunk(self, chunktext: str) -> str:
+        start_time = time.perf_counter()
+        try:
+            return await super().formatchunk(chunktext)
+        finally:
+            self.chunk_latencies.append(time.perf_counter() - start_time)
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, or None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * fraction // 1))
+    return ordered[int(rank) - 1]
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (includes an in-process mock server)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return round(peak / (1024 * 1024 if os.uname().sysname == 'Darwin' else 1024), 1)
+
+def summarize(name, words, requests, latencies, seconds):
+    return {
+        "document": name,
+        "words": words,
+        "chunks": len(latencies),
+        "requests": requests,
+        "seconds": round(seconds, 3),
+        "words_per_second": round(words / seconds, 1) if seconds else 0.0,
+        "requests_per_second": round(requests / seconds, 2) if seconds else 0.0,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+async def run_document(document, url, concurrency, output_dir):
+    parser = TimedParseFile(concurrency=concurrency, use_cache=False, mode="run", api_url=url)
+    output_file = output_path(document, output_dir)
+    start_time = time.perf_counter()
+    async with parser:
+        await parser.process(
+            document,
+            output_file=output_file,
+            checkpoint_file=output_file + '.checkpoint.json',
+            diagnostics=False
+        )
+    seconds = time.perf_counter() - start_time
+    requests = parser.metrics.counters.get("requests", 0)
+    result = summarize(document, parser.input_word_pointer, requests, parser.chunk_latencies, seconds)
+    result["metrics"] = parser.metrics.summary()
+    return parser, result
+
+async def run_benchmark(documents, concurrency, output_dir, url=None, mock=None):
+    """
+    Formats each document in turn against url (one URL or a list of replicas),
+    or against in-process mock servers when url is None, and returns
+    per-document and overall figures. mock may be a list to start one mock
+    replica per entry. The response cache is bypassed so every chunk reaches
+    the server.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    runners = []
+    mocks = []
+    if url is None:
+        mocks = mock if isinstance(mock, list) else [mock or mock_server.MockCompletions()]
+        urls = []
+        for replica in mocks:
+            runner, replica_url = await mock_server.start(replica)
+            runners.append(runner)
+            urls.append(replica_url)
+            logger.info(f'Mock completions server listening on {replica_url}')
+        url = urls if len(urls) > 1 else urls[0]
+
+    results = []
+    latencies = []
+    words = requests = 0
+    start_time = time.perf_counter()
+    try:
+        for document in documents:
+            logger.info(f'Benchmarking {document}')
+            parser, result = await run_document(document, url, concurrency, output_dir)
+            results.append(result)
+            latencies.extend(parser.chunk_latencies)
+            words += parser.input_word_pointer
+            requests += result["requests"]
+    finally:
+        await http_client.close_session()
+        for runner in runners:
+            await runner.cleanup()
+
+    report = {
+        "url": url,
+        "concurrency": concurrency,
+        "total": summarize("total", words, requests, latencies, time.perf_counter() - start_time),
+        "results": results
+    }
+    if mocks:
+        report["server"] = {key: sum(replica.stats[key] for replica in mocks) for key in mocks[0].stats}
+    with open(os.path.join(output_dir, 'report.json'), 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return report
+
+def print_report(report):
+    columns = ("words", "chunks", "requests", "seconds", "words_per_second",
+               "requests_per_second", "p50_ms", "p95_ms", "p99_ms", "peak_rss_mb")
+    headers = ("words", "chunks", "reqs", "secs", "words/s", "reqs/s", "p50 ms", "p95 ms", "p99 ms", "rss MiB")
+    width = max(len(os.path.basename(row["document"])) for row in report["results"] + [report["total"]])
+    print(f'{"document":<{width}}  ' + '  '.join(f'{header:>8}' for header in headers))
+    for row in report["results"] + [report["total"]]:
+        values = ('-' if row[column] is None else row[column] for column in columns)
+        print(f'{os.path.basename(row["document"]):<{width}}  ' + '  '.join(f'{value:>8}' for value in values))
+    if "server" in report:
+        print('server: ' + ', '.join(f'{key} {value}' for key, value in report["server"].items()))
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure formatting throughput and latency.")
+    parser.add_argument("inputs", nargs="*", default=BENCHMARK_DOCUMENTS,
+                        help="documents, directories or globs (default: BENCHMARK_DOCUMENTS)")
+    parser.add_argument("--url", nargs="+", help="benchmark running servers (one URL per replica) instead of the built-in mock")
+    parser.add_argument("--concurrency", type=int, default=PIPELINE_CONCURRENCY, help="chunks in flight per document")
+    parser.add_argument("--output-dir", default=BENCHMARK_OUTPUT_DIR, help="where outputs and report.json are written")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.02, help="mock uniform +/- seconds added to the latency")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="mock seconds between streamed events")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="mock fraction of requests answered with an error")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="mock fraction of prompts answered with non-JSON text")
+    parser.add_argument("--slots", type=int, default=0, help="mock requests generated at once (0 = unlimited)")
+    parser.add_argument("--replicas", type=int, default=1, help="mock servers to balance requests across")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    configure_logging()
+    documents = [document for pattern in args.inputs for document in find_documents(pattern)]
+    if not documents:
+        raise SystemExit(f"No documents match {' '.join(args.inputs)}")
+
+    mocks = None
+    url = None
+    if args.url:
+        url = args.url if len(args.url) > 1 else args.url[0]
+    else:
+        mocks = [
+            mock_server.MockCompletions(
+                latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+                failure_rate=args.failure_rate, malformed_rate=args.malformed_rate,
+                slots=args.slots, seed=args.seed + replica
+            )
+            for replica in range(max(1, args.replicas))
+        ]
+    report = asyncio.run(run_benchmark(documents, args.concurrency, args.output_dir, url, mocks))
+    print_report(report)
+
+if __name__ == "__main__":
+    main()
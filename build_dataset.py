@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# build_dataset.py
+import os
+import glob
+import json
+import random
+import asyncio
+import hashlib
+import logging
+import tempfile
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from logger import configure_logging
+from deformat import process_transcript
+from process import ParseFile
+import prepare_dataset
+from config import DATASET_BOOKS_DIR, DATASET_FILE, DATASET_PRETOKENIZED_DIR, EVAL_DOCUMENTS
+
+logger = logging.getLogger(__name__)
+
+def find_pairs(books_dir, held_out=EVAL_DOCUMENTS):
+    """
+    Returns (unformatted, formatted) paths for every *formatted.txt in books_dir
+    except the books held out for evaluate_checkpoints.py. The unformatted copy
+    is the same name without "formatted"; None when the book has no
+    unformatted copy and must be deformatted first.
+    """
+    held_out = {os.path.abspath(path) for pattern in held_out for path in glob.glob(pattern)}
+    pairs = []
+    for formatted in sorted(glob.glob(os.path.join(books_dir, '*formatted.txt'))):
+        if os.path.abspath(formatted) in held_out:
+            logger.info(f'Leaving out {formatted}, it is held out for evaluation')
+            continue
+        unformatted = os.path.join(books_dir, os.path.basename(formatted).replace('formatted', ''))
+        pairs.append((unformatted if os.path.exists(unformatted) else None, formatted))
+    return pairs
+
+def chunk_pair(pair):
+    """
+    Chunks one book in desiredoutput mode, with the same overlap logic as
+    ParseFile.process, and returns its training pairs as JSON lines together
+    with the number dropped because the output's words are not the input's.
+    """
+    unformatted, formatted = pair
+    with tempfile.TemporaryDirectory() as work_dir:
+        if unformatted is None:
+            unformatted = process_transcript(formatted, work_dir)
+        training_file = os.path.join(work_dir, 'pairs.jsonl')
+        parser = ParseFile(concurrency=1, use_cache=False, mode="desiredoutput",
+                           desired_file=formatted, training_file=training_file)
+        asyncio.run(parser.process(
+            unformatted,
+            output_file=os.path.join(work_dir, 'output.txt'),
+            checkpoint_file=os.path.join(work_dir, 'checkpoint.json'),
+            diagnostics=False
+        ))
+        if not os.path.exists(training_file):
+            return [], 0
+        with open(training_file, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+
+    kept = []
+    for line in lines:
+        entry = json.loads(line)
+        if parser.input_words(entry["output"]) == entry["input"].split():
+            kept.append(line)
+    dropped = len(lines) - len(kept)
+    if dropped:
+        logger.warning(f'{formatted}: dropped {dropped} of {len(lines)} pairs whose output words differ from the input')
+    return kept, dropped
+
+def shard_paths(output_file, shards):
+    if shards <= 1:
+        return [output_file]
+    stem, extension = os.path.splitext(output_file)
+    return [f'{stem}-{index:05d}-of-{shards:05d}{extension}' for index in range(shards)]
+
+def write_shards(lines, output_file, shards):
+    """Splits lines into contiguous shards of near-equal size and writes each atomically."""
+    paths = shard_paths(output_file, shards)
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    size, extra = divmod(len(lines), len(paths))
+    start = 0
+    for index, path in enumerate(paths):
+        end = start + size + (1 if index < extra else 0)
+        temp_file = path + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            f.writelines(line + '\n' for line in lines[start:end])
+        os.replace(temp_file, path)
+        start = end
+    return paths
+
+def build(books_dir, output_file, shards=1, shuffle=False, seed=0, workers=None):
+    """Chunks every book pair in parallel processes and writes deduplicated JSONL shards."""
+    pairs = find_pairs(books_dir)
+    if not pairs:
+        raise ValueError(f"No *formatted.txt books in {books_dir}")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(chunk_pair, pairs))
+
+    seen = set()
+    lines = []
+    dropped = 0
+    for (_, formatted), (book_lines, book_dropped) in zip(pairs, results):
+        dropped += book_dropped
+        before = len(lines)
+        for line in book_lines:
+            digest = hashlib.sha1(line.encode('utf-8')).digest()
+            if digest not in seen:
+                seen.add(digest)
+                lines.append(line)
+        logger.info(f'{formatted}: {len(book_lines)} pairs, {len(lines) - before} new, {book_dropped} dropped')
+    if dropped:
+        logger.warning(f'{dropped} pairs dropped in total because their output words differ from the input')
+
+    if shuffle:
+        random.Random(seed).shuffle(lines)
+    return lines, write_shards(lines, output_file, shards)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the training dataset from every book pair.")
+    parser.add_argument("--books", default=DATASET_BOOKS_DIR, help="directory of *formatted.txt books")
+    parser.add_argument("--output", default=DATASET_FILE, help="JSONL file (shards get -NNNNN-of-NNNNN suffixes)")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--shuffle", action="store_true", help="shuffle the pairs before sharding")
+    parser.add_argument("--seed", type=int, default=0, help="shuffle seed")
+    parser.add_argument("--workers", type=int, help="parallel processes (default: one per CPU)")
+    parser.add_argument("--pretokenize", nargs="?", const=DATASET_PRETOKENIZED_DIR,
+                        help="also write a pre-tokenized Arrow dataset (default: DATASET_PRETOKENIZED_DIR)")
+    args = parser.parse_args()
+
+    configure_logging()
+    lines, paths = build(args.books, args.output, args.shards, args.shuffle, args.seed, args.workers)
+    print(f'{len(lines)} pairs written to {", ".join(paths)}')
+
+    if args.pretokenize:
+        stats = prepare_dataset.prepare((json.loads(line) for line in lines), args.pretokenize)
+        print(f'{stats["written"]} examples pre-tokenized into {args.pretokenize}: {stats["reused"]} reused, '
+              f'{stats["tokenized"]} tokenized, {stats["dropped"]} too long')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# completion_batcher.py
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CompletionBatcher:
+    """
+    Collects concurrent completions requests and sends them to /v1/completions as
+    one request with a list of prompts. A batch is sent once it holds batch_size
+    prompts or max_wait seconds after its first prompt arrived. Only requests with
+    identical sampling parameters share a batch. If the server rejects list prompts
+    or returns the wrong number of choices, batching is switched off and every
+    request is sent on its own, concurrently.
+    """
+
+    def __init__(self, post, batch_size: int, max_wait: float):
+        self.post = post
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.supported = True
+        self.queues = {}
+        self.timers = {}
+        self.tasks = set()
+
+    async def submit(self, payload: dict) -> dict:
+        """Queues one request and returns a response holding only its own choice."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.supported or self.batch_size <= 1:
+            self.start(self.send_one(payload, future))
+            return await future
+
+        key = json.dumps({k: v for k, v in payload.items() if k != "prompt"}, sort_keys=True)
+        queue = self.queues.setdefault(key, [])
+        queue.append((payload, future))
+        if len(queue) >= self.batch_size:
+            self.flush(key)
+        elif key not in self.timers:
+            self.timers[key] = loop.call_later(self.max_wait, self.flush, key)
+        return await future
+
+    def start(self, coro):
+        task = asyncio.create_task(coro)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    def flush(self, key):
+        timer = self.timers.pop(key, None)
+        if timer:
+            timer.cancel()
+        batch = self.queues.pop(key, [])
+        if batch:
+            self.start(self.send(batch))
+
+    async def send_one(self, payload, future):
+        try:
+            result = await self.post(payload)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+            return
+        if not future.done():
+            future.set_result(result)
+
+    async def send(self, batch):
+        batch = [(payload, future) for payload, future in batch if not future.done()]
+        if len(batch) <= 1 or not self.supported:
+            await asyncio.gather(*(self.send_one(payload, future) for payload, future in batch))
+            return
+
+        payload = dict(batch[0][0])
+        payload["prompt"] = [item[0]["prompt"] for item in batch]
+        try:
+            result = await self.post(payload)
+            choices = self.split_choices(result, len(batch))
+        except Exception as e:
+            if getattr(e, "retryable", True):
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            choices = None
+
+        if choices is None:
+            logger.warning("Server does not accept batched prompts, sending requests individually")
+            self.supported = False
+            await asyncio.gather(*(self.send_one(payload, future) for payload, future in batch))
+            return
+
+        # usage covers the whole batch, so it is not handed to any single request
+        shared = {key: value for key, value in result.items() if key != "usage"}
+        for (_, future), choice in zip(batch, choices):
+            if not future.done():
+                future.set_result({**shared, "choices": [choice]})
+
+    def split_choices(self, result, count):
+        """Orders the choices of a batched response by prompt, or None if they do not line up."""
+        choices = result.get("choices") or []
+        if len(choices) != count:
+            return None
+        if all("index" in choice for choice in choices):
+            choices = sorted(choices, key=lambda choice: choice["index"])
+            if [choice["index"] for choice in choices] != list(range(count)):
+                return None
+        return choices
@@ -1,8 +1,18 @@
 # Chunk processing configuration
 CHUNK_OVERLAP = 75                # Increased overlap for smoother transitions
 OUTPUT_CHUNK_SIZE = 125           # Adjusted output size
+ADAPTIVE_CHUNKS = False           # Size chunks in model tokens instead of OUTPUT_CHUNK_SIZE words
+CONTEXT_WINDOW = 4096             # n_ctx the model is loaded with
+TOKENIZER_DIR = 'training/datasets/model-out'
+OUTPUT_TOKEN_RATIO = 1.3          # Generated tokens per input token (punctuation, JSON)
+TOKEN_MARGIN = 0.9                # Fraction of the token budget a chunk may use
+CHARS_PER_TOKEN = 4               # Estimate used when no tokenizer library is installed
+ADAPTIVE_OVERLAP = False          # Carry over only the text after the last closed sentence;
+                                  # needs ADAPTIVE_CHUNKS, fixed chunks carry no overlap after chunk 2
+PIPELINE_CONCURRENCY = 1          # Chunks in flight in run mode (1 = serial)
 
 # Text processing parameters
+PREPROCESS_BLOCK_SIZE = 1 << 20   # Characters read per block when streaming input
 SENTENCE_MARKER = chr(0x0a)       # Unicode character for boundaries
 
 # File paths (unchanged)
@@ -14,10 +24,30 @@ POSTPROCESSED_FILE = 'files/transcript_postprocessed.txt'
 OUTPUT_FILE = 'files/transcript_formatted.txt'
 TEST_INPUT = 'files/testintput.txt'
 TEST_OUTPUT = 'files/testoutput.txt'
+CHECKPOINT_FILE = 'files/checkpoint.json'
+BATCH_OUTPUT_DIR = 'files/batch'
+BATCH_WORKERS = 4                 # Documents formatted at once by batch_process.py
+CHECKPOINT_INTERVAL = 10          # Chunks between checkpoints (0 = off)
+BENCHMARK_DOCUMENTS = ['books/*.txt', 'files/yt_transcript.txt']
+BENCHMARK_OUTPUT_DIR = 'files/benchmark'
+METRICS_FILE = 'files/metrics.json'
+METRICS_PROMETHEUS_FILE = None    # Also write Prometheus text metrics here (None = off)
 
 # API configuration
 API_URL = "http://0.0.0.0:5000/v1/completions"
 API_TIMEOUT = 120                 # Increased timeout
+API_REPLICAS = 1                  # Servers on consecutive ports from API_URL's (startlora.py --replicas)
+REPLICA_EJECT_AFTER = 3           # Consecutive failures before a replica is taken out of rotation
+REPLICA_EJECT_SECONDS = 30.0      # How long an ejected replica gets no requests
+HTTP_POOL_LIMIT = 32              # Pooled connections shared by all clients
+HTTP_POOL_PER_HOST = 16           # Pooled connections per server
+HTTP_DNS_CACHE_TTL = 300          # Seconds to cache DNS lookups
+HTTP_KEEPALIVE_TIMEOUT = 60       # Seconds an idle connection is kept open
+COMPLETION_BATCH_SIZE = 1         # Prompts sent per completions request (1 = no batching)
+COMPLETION_BATCH_WAIT = 0.05      # Seconds to wait for a batch to fill
+STREAM_RESPONSES = False          # Stream tokens and stop once the output covers the input
+STREAM_ABORT_ON_DRIFT = True      # Abort and retry a streamed chunk whose words drift from the input
+MODEL_NAME = "mythomakisemerged-13b.Q5_K_S.gguf"  # Model the server has loaded
 MAX_TOKENS = 800                  # Increased token limit
 # EXPANDED STOP_SEQUENCES to prevent LLM injecting unwanted instructional text
 STOP_SEQUENCES = [
@@ -36,6 +66,11 @@ TOP_P = 0.9                       # Focused sampling
 TOP_K = 50                        # Balanced predictability
 TOP_T = TOP_K # Retained TOP_T = TOP_K as it was in your original config. If your API doesn't use it, it will be ignored.
 
+# Response cache for formatchunk
+RESPONSE_CACHE = True             # Reuse responses for identical requests
+RESPONSE_CACHE_FILE = 'cache/responses.sqlite3'
+RESPONSE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
 # Validation and logging
 MAX_SENTENCE_VALIDATION_ERRORS = 3  # Stricter validation
 LOG_DIR = 'logs'
@@ -51,12 +86,31 @@ PRESERVE_PARAGRAPHS = True        # Maintain paragraph structure
 # Quality control
 MIN_SENTENCE_QUALITY = 0.8        
 MAX_RETRIES = 3                   
+RETRY_BACKOFF = 1.0               # Base backoff in seconds, doubled per retry
+RETRY_BACKOFF_MAX = 30.0          # Cap on a single backoff delay
+HEDGE_AFTER = 0                   # Seconds before a duplicate request is sent (0 = off)
 #TEST_MODE = "run"
 #TEST_MODE = "unformatted"
 TEST_MODE = "desiredoutput"
 TEST_FILE = 'files/alicewarren.txt'
 DESIRED_OUTPUT = 'alicewarrenformatted.txt'
 TRAINING_FILE = 'files/trainingchunks.txt'
+TRAINING_BATCH_SIZE = 64          # Training pairs buffered per append
+
+# Training dataset build
+DATASET_BOOKS_DIR = 'books'       # Formatted books (and their unformatted copies) to chunk
+DATASET_FILE = 'training/datasets/augmented_dataset.jsonl'
+DATASET_PRETOKENIZED_DIR = 'training/datasets/pretokenized'
+AXOLOTL_PREPARED_DIR = 'training/datasets/last_run_prepared'
+LORA_OUTPUT_DIR = 'training/datasets/model-out'   # Trained adapter and its checkpoint-N directories
+
+# Checkpoint evaluation
+EVAL_DOCUMENTS = ['books/thecarnalgodformatted.txt']  # Formatted books held out of training; build_dataset.py skips them
+EVAL_CHUNKS = 40                  # Chunks sampled evenly from EVAL_DOCUMENTS (0 = all)
+EVAL_CONCURRENCY = 4              # Requests in flight per server while evaluating
+EVAL_OUTPUT_FILE = 'files/checkpoint_eval.json'
+EVAL_OVERLAP_NGRAM = 8            # Words per n-gram when checking eval chunks against DATASET_FILE
+SEQUENCE_LEN = 2048               # Axolotl sequence_len; longer examples are dropped
 
 __all__ = [
     'CHUNK_SIZE', 'CHUNK_OVERLAP', 'OUTPUT_CHUNK_SIZE', 'POSTPROCESSED_FILE',
@@ -66,5 +120,18 @@ __all__ = [
     'MAX_SENTENCE_VALIDATION_ERRORS', 'LOG_DIR', 'LOG_FILE',
     'DEBUG_LOG_FILE', 'PRESERVE_CASE', "TEST_OUTPUT", "DESIRED_OUTPUT"
     'STRICT_PUNCTUATION', 'PRESERVE_PARAGRAPHS', 'TRAINING_FILE',
-    'MIN_SENTENCE_QUALITY', 'MAX_RETRIES', 'TEST_MODE'
+    'MIN_SENTENCE_QUALITY', 'MAX_RETRIES', 'TEST_MODE', 'PIPELINE_CONCURRENCY',
+    'TRAINING_BATCH_SIZE', 'MODEL_NAME', 'RESPONSE_CACHE', 'RESPONSE_CACHE_FILE',
+    'RESPONSE_CACHE_MAX_BYTES', 'CHECKPOINT_FILE', 'CHECKPOINT_INTERVAL',
+    'PREPROCESS_BLOCK_SIZE', 'RETRY_BACKOFF', 'RETRY_BACKOFF_MAX', 'HEDGE_AFTER',
+    'HTTP_POOL_LIMIT', 'HTTP_POOL_PER_HOST', 'HTTP_DNS_CACHE_TTL', 'HTTP_KEEPALIVE_TIMEOUT',
+    'COMPLETION_BATCH_SIZE', 'COMPLETION_BATCH_WAIT', 'BATCH_OUTPUT_DIR', 'BATCH_WORKERS',
+    'STREAM_RESPONSES', 'STREAM_ABORT_ON_DRIFT', 'ADAPTIVE_CHUNKS', 'CONTEXT_WINDOW',
+    'TOKENIZER_DIR', 'OUTPUT_TOKEN_RATIO', 'TOKEN_MARGIN', 'CHARS_PER_TOKEN',
+    'ADAPTIVE_OVERLAP', 'BENCHMARK_DOCUMENTS', 'BENCHMARK_OUTPUT_DIR',
+    'METRICS_FILE', 'METRICS_PROMETHEUS_FILE', 'DATASET_BOOKS_DIR', 'DATASET_FILE',
+    'DATASET_PRETOKENIZED_DIR', 'SEQUENCE_LEN', 'AXOLOTL_PREPARED_DIR', 'API_REPLICAS',
+    'REPLICA_EJECT_AFTER', 'REPLICA_EJECT_SECONDS', 'LORA_OUTPUT_DIR',
+    'EVAL_DOCUMENTS', 'EVAL_CHUNKS', 'EVAL_CONCURRENCY', 'EVAL_OUTPUT_FILE',
+    'EVAL_OVERLAP_NGRAM'
 ]
\ No newline at end of file
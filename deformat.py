@@ -1,59 +1,82 @@
 import re
 import os
-from config import DESIRED_OUTPUT
+import glob
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from config import DESIRED_OUTPUT, SENTENCE_MARKER
 
-def process_transcript(input_file):
+NON_WORD = re.compile(r'[^\w\s]')
+NON_LETTER = re.compile(f'[^a-z\\s{re.escape(SENTENCE_MARKER)}]')
+NEWLINE = {ord('\n'): ' ', ord(SENTENCE_MARKER): ' '}
+# Every whitespace character (all lie below U+3001) becomes a plain space. Capital
+# sigma is mapped up front because str.lower() would give the final form at word ends.
+WHITESPACE = {code: ' ' for code in range(0x3001) if chr(code).isspace()}
+WHITESPACE[ord('Σ')] = 'σ'
+
+def deformat_text(text, letters_only=False):
+    """
+    Strips formatting from text using C-level passes only (regex, lower,
+    translate) instead of per-character Python loops.
+
+    By default punctuation is removed (word characters and whitespace are
+    kept), the text is lowercased and every whitespace character becomes a
+    space. With letters_only, as ParseFile.deformat uses it, the text is
+    lowercased first, everything but a-z and whitespace is removed and
+    newlines become spaces.
+    """
+    if letters_only:
+        return NON_LETTER.sub('', text.lower()).translate(NEWLINE)
+    return NON_WORD.sub('', text).translate(WHITESPACE).lower()
+
+def process_transcript(input_file, output_dir='files'):
     # Read the input file
     with open(input_file, 'r', encoding='utf-8') as f:
         text = f.read()
-    
-    # Step 1: Replace newlines with a special character (using a non-whitespace control character)
-    special_char = '\x1E'  # Using INFORMATION SEPARATOR TWO (U+001E) as our special character
-    text = text.replace('\n', special_char)
-    
-    # Step 2: Replace all whitespace (except our special char) with single space
-    # We'll first protect our special character during whitespace normalization
-    protected_text = []
-    for char in text:
-        if char == special_char:
-            protected_text.append(special_char)
-        elif char.isspace():
-            protected_text.append(' ')
-        else:
-            protected_text.append(char)
-    text = ''.join(protected_text)
-    
-    # Step 3: Remove all punctuation (keeping alphanumeric and our special char)
-    text = re.sub(fr'[^\w\s{re.escape(special_char)}]', '', text)
-    
-    # Step 4: Convert to lowercase (excluding our special char)
-    processed_text = []
-    for char in text:
-        if char == special_char:
-            processed_text.append(char)
-        else:
-            processed_text.append(char.lower())
-    text = ''.join(processed_text)
-    
-    # Step 5: Replace newlines (special character) with spaces
-    text = text.replace(special_char, ' ')
-    
+
+    # Remove punctuation, lowercase and turn newlines and other whitespace into spaces
+    text = deformat_text(text)
+
     # Create output filename
     base_name = os.path.basename(input_file)
     if 'formatted' in base_name:
         output_name = base_name.replace('formatted', '')
     else:
         output_name = os.path.splitext(base_name)[0] + '.txt'
-    
+
     # Write to output file
-    output_path = os.path.join('files', output_name)
+    output_path = os.path.join(output_dir, output_name)
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(text)
-    
+
     return output_path
 
+def find_formatted(paths):
+    """Expands directories to the *formatted.txt files in them."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, '*formatted.txt'))))
+        else:
+            files.append(path)
+    return files
+
+def process_all(input_files, output_dir='files', workers=None):
+    """Deformats input_files in parallel processes and returns the output paths in order."""
+    os.makedirs(output_dir, exist_ok=True)
+    if len(input_files) <= 1:
+        return [process_transcript(input_file, output_dir) for input_file in input_files]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(process_transcript, input_files, [output_dir] * len(input_files)))
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strip the formatting from formatted documents.")
+    parser.add_argument("inputs", nargs="*", help="files, or directories whose *formatted.txt files are "
+                                                  "deformatted (default: files/DESIRED_OUTPUT)")
+    parser.add_argument("--output-dir", default='files', help="where deformatted files are written")
+    parser.add_argument("--workers", type=int, help="parallel processes (default: one per CPU)")
+    args = parser.parse_args()
+
     # Process the desired output file
-    input_file = os.path.join('files', DESIRED_OUTPUT)
-    output_file = process_transcript(input_file)
-    print(f"Processed file saved to: {output_file}")
\ No newline at end of file
+    input_files = find_formatted(args.inputs) if args.inputs else [os.path.join('files', DESIRED_OUTPUT)]
+    for output_file in process_all(input_files, args.output_dir, args.workers):
+        print(f"Processed file saved to: {output_file}")
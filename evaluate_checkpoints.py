@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+# evaluate_checkpoints.py
+import os
+import json
+import glob
+import time
+import asyncio
+import logging
+import argparse
+from logger import configure_logging
+import http_client
+import mock_server
+import quality
+from benchmark import percentile, ms
+from deformat import deformat_text
+from model_loader import ModelRegistry, server_root, list_checkpoints
+from process import ParseFile
+from replica_pool import ReplicaPool, replica_urls
+from prepare_dataset import read_records
+from config import (
+    API_URL, API_REPLICAS, OUTPUT_CHUNK_SIZE, LORA_OUTPUT_DIR, DATASET_FILE,
+    EVAL_DOCUMENTS, EVAL_CHUNKS, EVAL_CONCURRENCY, EVAL_OUTPUT_FILE, EVAL_OVERLAP_NGRAM
+)
+
+logger = logging.getLogger(__name__)
+
+def held_out_chunks(documents, chunk_words: int = OUTPUT_CHUNK_SIZE, limit: int = EVAL_CHUNKS):
+    """
+    Cuts formatted documents into chunks of whole lines (sentences) of about
+    chunk_words words and returns up to `limit` of them, evenly spaced, as
+    (input, reference) pairs. The input is deformatted the way ParseFile
+    deformats the text it sends.
+    """
+    chunks = []
+    for document in documents:
+        with open(document, 'r', encoding='utf-8') as f:
+            lines = [line.strip() for line in f if line.strip()]
+        current = []
+        words = 0
+        for line in lines:
+            current.append(line)
+            words += len(line.split())
+            if words >= chunk_words:
+                chunks.append(current)
+                current = []
+                words = 0
+        if current:
+            chunks.append(current)
+
+    if limit and len(chunks) > limit:
+        step = len(chunks) / limit
+        chunks = [chunks[int(index * step)] for index in range(limit)]
+    return [(' '.join(deformat_text('\n'.join(lines), letters_only=True).split()), '\n'.join(lines))
+            for lines in chunks]
+
+def dataset_files(dataset_file: str = DATASET_FILE):
+    """DATASET_FILE and the shards build_dataset.py --shards writes next to it."""
+    stem, extension = os.path.splitext(dataset_file)
+    paths = glob.glob(f'{glob.escape(stem)}-*-of-*{extension}')
+    if os.path.exists(dataset_file):
+        paths.append(dataset_file)
+    return sorted(paths)
+
+def ngrams(text, n):
+    words = text.split()
+    return {hash(' '.join(words[index:index + n])) for index in range(max(1, len(words) - n + 1))}
+
+def overlapping_chunks(chunks, paths, n: int = EVAL_OVERLAP_NGRAM, threshold: float = 0.5):
+    """
+    Indices of the chunks at least `threshold` of whose n-word runs also occur
+    in the training records of paths, i.e. text the checkpoints were trained on.
+    """
+    seen = set()
+    for record in read_records(paths):
+        for field in ("input", "output"):
+            seen |= ngrams(deformat_text(record.get(field) or '', letters_only=True), n)
+    overlapping = []
+    for index, (text, _) in enumerate(chunks):
+        grams = ngrams(text, n)
+        if len(grams & seen) >= threshold * len(grams):
+            overlapping.append(index)
+    return overlapping
+
+def trainer_state(lora_dir, name):
+    """The step and the last logged train and eval loss of a checkpoint, from its trainer_state.json."""
+    path = os.path.join(os.path.dirname(os.path.abspath(lora_dir)), name, 'trainer_state.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    history = state.get("log_history", [])
+    return {
+        "step": state.get("global_step"),
+        "loss": next((entry["loss"] for entry in reversed(history) if "loss" in entry), None),
+        "eval_loss": next((entry["eval_loss"] for entry in reversed(history) if "eval_loss" in entry), None)
+    }
+
+async def evaluate(name, chunks, registry, url, concurrency):
+    """Switches the server at url to the LoRA `name` and formats every chunk with requests in flight."""
+    row = {"checkpoint": name, "server": registry.server_url}
+    switched = await registry.ensure(loras=[name])
+    row["switch_seconds"] = switched["seconds"]
+    if not switched["success"]:
+        row["error"] = switched["error"]
+        return row
+
+    # Same prompt as formatting a document; the cache would answer every checkpoint alike
+    parser = ParseFile(concurrency=concurrency, use_cache=False, mode="run", pool=ReplicaPool([url]))
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    latencies = []
+    failures = 0
+
+    async def format_chunk(text):
+        nonlocal failures
+        async with semaphore:
+            start_time = time.perf_counter()
+            try:
+                return await parser.formatchunk(text)
+            except Exception as e:
+                failures += 1
+                logger.warning(f'{name}: chunk failed: {e}')
+                return ''
+            finally:
+                latencies.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    outputs = await asyncio.gather(*(format_chunk(text) for text, _ in chunks))
+    seconds = time.perf_counter() - start_time
+
+    score = quality.score('\n'.join(reference for _, reference in chunks), '\n'.join(outputs))
+    words = sum(len(text.split()) for text, _ in chunks)
+    row.update(
+        chunks=len(chunks),
+        failures=failures,
+        coverage=score["words"]["coverage"],
+        punctuation_f1=score["punctuation"]["f1"],
+        punctuation_precision=score["punctuation"]["precision"],
+        punctuation_recall=score["punctuation"]["recall"],
+        sentence_f1=score["sentence_breaks"]["f1"],
+        p50_ms=ms(percentile(latencies, 0.50)),
+        p95_ms=ms(percentile(latencies, 0.95)),
+        words_per_second=round(words / seconds, 1) if seconds else 0.0,
+        score=score
+    )
+    return row
+
+async def run_evaluation(checkpoints, chunks, urls, concurrency: int = EVAL_CONCURRENCY,
+                         lora_dir: str = LORA_OUTPUT_DIR):
+    """
+    Evaluates the checkpoints on the servers at urls. Checkpoints are dealt
+    out to the servers round-robin and every server works through its share
+    at the same time, so N replicas evaluate N checkpoints in parallel. The
+    LoRAs each server had loaded are restored afterwards. Returns the rows
+    ranked by punctuation F1, then sentence-break F1, then median latency.
+    """
+    registries = [ModelRegistry(server_root(url)) for url in urls]
+    previous = []
+    for registry in registries:
+        try:
+            previous.append((await registry.refresh())[1])
+        except Exception as e:
+            logger.warning(f'Cannot read what {registry.server_url} has loaded: {e}')
+            previous.append(None)
+
+    async def lane(index):
+        rows = []
+        for name in checkpoints[index::len(urls)]:
+            logger.info(f'Evaluating {name} on {registries[index].server_url}')
+            row = await evaluate(name, chunks, registries[index], urls[index], concurrency)
+            row.update(trainer_state(lora_dir, name))
+            rows.append(row)
+        return rows
+
+    try:
+        lanes = await asyncio.gather(*(lane(index) for index in range(min(len(urls), len(checkpoints)))))
+    finally:
+        for registry, loras in zip(registries, previous):
+            if loras is not None:
+                await registry.ensure(loras=loras)
+
+    rows = [row for rows in lanes for row in rows]
+    rows.sort(key=lambda row: (
+        "error" in row,
+        -row.get("punctuation_f1", 0.0),
+        -row.get("sentence_f1", 0.0),
+        row.get("p50_ms") or float('inf')
+    ))
+    for rank, row in enumerate(rows, 1):
+        row["rank"] = rank
+    return rows
+
+def print_table(rows):
+    columns = ("rank", "step", "punctuation_f1", "sentence_f1", "coverage", "failures",
+               "p50_ms", "p95_ms", "words_per_second", "loss")
+    headers = ("rank", "step", "punct F1", "sent F1", "coverage", "fails", "p50 ms", "p95 ms", "words/s", "loss")
+    width = max(len("checkpoint"), *(len(row["checkpoint"]) for row in rows))
+    print(f'{"checkpoint":<{width}}  ' + '  '.join(f'{header:>8}' for header in headers))
+    for row in rows:
+        if "error" in row:
+            print(f'{row["checkpoint"]:<{width}}  failed: {row["error"]}')
+            continue
+        values = ('-' if row.get(column) is None else row[column] for column in columns)
+        print(f'{row["checkpoint"]:<{width}}  ' + '  '.join(f'{value:>8}' for value in values))
+
+async def main_async(args):
+    documents = sorted(path for pattern in args.documents for path in glob.glob(pattern))
+    if not documents:
+        raise SystemExit(f"No documents match {' '.join(args.documents)}")
+    chunks = held_out_chunks(documents, limit=args.chunks)
+    paths = dataset_files(args.dataset)
+    overlapping = overlapping_chunks(chunks, paths) if paths else []
+    if overlapping:
+        message = (f'{len(overlapping)} of {len(chunks)} evaluation chunks occur in the training data '
+                   f'({", ".join(paths)}); the ranking would measure memorization')
+        if not args.allow_overlap:
+            raise SystemExit(message + '. Evaluate on documents left out of training or pass --allow-overlap.')
+        logger.warning(message)
+    checkpoints = args.checkpoints or list_checkpoints(args.lora_dir)
+    if not checkpoints:
+        raise SystemExit(f"No checkpoints in {args.lora_dir}")
+    logger.info(f'{len(chunks)} held-out chunks from {len(documents)} documents, {len(checkpoints)} checkpoints')
+
+    runners = []
+    if args.mock:
+        urls = []
+        for seed in range(args.mock):
+            runner, url = await mock_server.start(mock_server.MockCompletions(latency=0.05, jitter=0.02, seed=seed))
+            runners.append(runner)
+            urls.append(url)
+    else:
+        urls = replica_urls(args.url, args.replicas)
+
+    try:
+        rows = await run_evaluation(checkpoints, chunks, urls, args.concurrency, args.lora_dir)
+    finally:
+        await http_client.close_session()
+        for runner in runners:
+            await runner.cleanup()
+
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({"documents": documents, "chunks": len(chunks), "overlapping_chunks": len(overlapping),
+                   "servers": urls, "results": rows}, f, indent=2)
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank LoRA checkpoints by punctuation quality and latency.")
+    parser.add_argument("checkpoints", nargs="*", help="LoRA names (default: every checkpoint in --lora-dir)")
+    parser.add_argument("--documents", nargs="+", default=EVAL_DOCUMENTS,
+                        help="formatted documents held out of training (default: EVAL_DOCUMENTS)")
+    parser.add_argument("--dataset", default=DATASET_FILE,
+                        help="training JSONL the documents are checked against (default: DATASET_FILE)")
+    parser.add_argument("--allow-overlap", action="store_true",
+                        help="evaluate even when the documents occur in the training data")
+    parser.add_argument("--chunks", type=int, default=EVAL_CHUNKS, help="chunks sampled from the documents (0 = all)")
+    parser.add_argument("--concurrency", type=int, default=EVAL_CONCURRENCY, help="requests in flight per server")
+    parser.add_argument("--url", default=API_URL, help="completions URL of the first server")
+    parser.add_argument("--replicas", type=int, default=API_REPLICAS,
+                        help="servers on consecutive ports; each evaluates its own share of the checkpoints")
+    parser.add_argument("--lora-dir", default=LORA_OUTPUT_DIR, help="trained adapter with checkpoint-N directories")
+    parser.add_argument("--output", default=EVAL_OUTPUT_FILE, help="where the ranked results are written as JSON")
+    parser.add_argument("--mock", type=int, default=0, metavar="N",
+                        help="dry run against N in-process mock servers instead of --url")
+    args = parser.parse_args()
+
+    configure_logging()
+    rows = asyncio.run(main_async(args))
+    print_table(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+# http_client.py
+import asyncio
+import aiohttp
+from config import HTTP_POOL_LIMIT, HTTP_POOL_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT
+
+_session = None
+_loop = None
+
+def create_session() -> aiohttp.ClientSession:
+    """Creates a session with a keep-alive connection pool and DNS cache."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+    )
+    return aiohttp.ClientSession(connector=connector)
+
+async def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the session shared by every caller on the running event loop, so
+    connections to the LLM server are reused instead of reopened per request.
+    """
+    global _session, _loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _loop is not loop:
+        _session = create_session()
+        _loop = loop
+    return _session
+
+async def close_session():
+    global _session, _loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _loop = None
+
+def run(coro):
+    """Runs a coroutine from synchronous code and closes the shared session afterwards."""
+    async def runner():
+        try:
+            return await coro
+        finally:
+            await close_session()
+    return asyncio.run(runner())
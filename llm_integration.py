@@ -2,6 +2,7 @@
 import aiohttp
 import logging
 from typing import Optional
+import http_client
 
 logger = logging.getLogger(__name__)
 
@@ -24,27 +25,28 @@ class MyLLMClient:
             "presence_penalty": 0.5
         }
         
-        async with aiohttp.ClientSession(timeout=self.timeout) as session:
-            try:
-                async with session.post(
-                    self.api_url,
-                    json=payload,
-                    headers={"Content-Type": "application/json"}
-                ) as response:
+        session = await http_client.get_session()
+        try:
+            async with session.post(
+                self.api_url,
+                json=payload,
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout
+            ) as response:
+                
+                if response.status != 200:
+                    error = await response.text()
+                    logger.error(f"LLM API error: {error}")
+                    raise ValueError(f"API returned {response.status}")
                     
-                    if response.status != 200:
-                        error = await response.text()
-                        logger.error(f"LLM API error: {error}")
-                        raise ValueError(f"API returned {response.status}")
-                        
-                    data = await response.json()
-                    result = data.get("choices", [{}])[0].get("text", "").strip()
+                data = await response.json()
+                result = data.get("choices", [{}])[0].get("text", "").strip()
+                
+                if not result:
+                    raise ValueError("Empty response from LLM")
                     
-                    if not result:
-                        raise ValueError("Empty response from LLM")
-                        
-                    return result
-                    
-            except Exception as e:
-                logger.error(f"LLM communication failed: {str(e)}")
-                raise ValueError(f"LLM error: {str(e)}")
\ No newline at end of file
+                return result
+                
+        except Exception as e:
+            logger.error(f"LLM communication failed: {str(e)}")
+            raise ValueError(f"LLM error: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,103 @@
+# metrics.py
+import os
+import json
+import time
+from contextlib import contextmanager
+
+PROMETHEUS_PREFIX = 'transcript'
+
+class Metrics:
+    """
+    Per-stage timers and counters for one formatting run. Stage times are
+    cumulative wall-clock seconds, so stages that run concurrently (several
+    chunks waiting on HTTP at once) or inside one another (JSON parsing while a
+    response streams) can add up to more than the run took.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.counters = {}
+        self.started = time.perf_counter()
+
+    @contextmanager
+    def time(self, stage: str):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start_time)
+
+    def add(self, stage: str, seconds: float):
+        timer = self.stages.get(stage)
+        if timer is None:
+            timer = self.stages[stage] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0}
+        timer["count"] += 1
+        timer["seconds"] += seconds
+        timer["max_seconds"] = max(timer["max_seconds"], seconds)
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def merge(self, other: "Metrics"):
+        """Adds another run's timers and counters to this one."""
+        for stage, timer in other.stages.items():
+            mine = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            mine["count"] += timer["count"]
+            mine["seconds"] += timer["seconds"]
+            mine["max_seconds"] = max(mine["max_seconds"], timer["max_seconds"])
+        for name, amount in other.counters.items():
+            self.count(name, amount)
+        self.started = min(self.started, other.started)
+
+    def summary(self) -> dict:
+        return {
+            "elapsed_seconds": round(time.perf_counter() - self.started, 6),
+            "stages": {
+                stage: {
+                    "count": timer["count"],
+                    "seconds": round(timer["seconds"], 6),
+                    "mean_ms": round(timer["seconds"] * 1000 / timer["count"], 3),
+                    "max_ms": round(timer["max_seconds"] * 1000, 3)
+                }
+                for stage, timer in sorted(self.stages.items())
+            },
+            "counters": dict(sorted(self.counters.items()))
+        }
+
+    def prometheus(self) -> str:
+        """The timers and counters in the Prometheus text exposition format."""
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f'# HELP {prefix}_stage_seconds_total Cumulative seconds spent in each pipeline stage.',
+            f'# TYPE {prefix}_stage_seconds_total counter'
+        ]
+        lines += [f'{prefix}_stage_seconds_total{{stage="{stage}"}} {timer["seconds"]:.6f}'
+                  for stage, timer in sorted(self.stages.items())]
+        lines += [
+            f'# HELP {prefix}_stage_calls_total Times each pipeline stage ran.',
+            f'# TYPE {prefix}_stage_calls_total counter'
+        ]
+        lines += [f'{prefix}_stage_calls_total{{stage="{stage}"}} {timer["count"]}'
+                  for stage, timer in sorted(self.stages.items())]
+        for name, amount in sorted(self.counters.items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {amount}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, json_file: str = None, prometheus_file: str = None):
+        """Writes the JSON summary and, when a path is given, the Prometheus text."""
+        for path, content in ((json_file, lambda: json.dumps(self.summary(), indent=2) + '\n'),
+                              (prometheus_file, self.prometheus)):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(content())
+
+    def report(self) -> str:
+        """One line per stage, for the log."""
+        lines = [f'{stage}: {timer["count"]} calls, {timer["seconds"]:.3f}s'
+                 for stage, timer in sorted(self.stages.items())]
+        lines += [f'{name}: {amount}' for name, amount in sorted(self.counters.items())]
+        return '; '.join(lines)
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# mock_server.py
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import logging
+from aiohttp import web
+from config import MODEL_NAME
+
+logger = logging.getLogger(__name__)
+
+class MockCompletions:
+    """
+    Stand-in for the server's OpenAI-compatible /v1/completions endpoint. It
+    answers every prompt with its "input" words punctuated deterministically:
+    a sentence ends after any word whose CRC32 is divisible by sentence_every,
+    so the same words are always punctuated the same way, whichever chunk they
+    fall in. Latency, jitter, per-token streaming delay, error responses and
+    malformed model output can be injected. With slots set, only that many
+    requests are generated at once and the rest queue, like a real server
+    whose compute is saturated. List prompts and stream=True are supported.
+    The /v1/internal model and LoRA endpoints record what is loaded and take
+    load_latency / lora_latency seconds, for exercising model_loader.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, token_latency: float = 0.0,
+                 failure_rate: float = 0.0, failure_status: int = 503, malformed_rate: float = 0.0,
+                 sentence_every: int = 9, slots: int = 0, load_latency: float = 0.0,
+                 lora_latency: float = 0.0, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_latency = token_latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.malformed_rate = malformed_rate
+        self.sentence_every = max(1, sentence_every)
+        self.slots = asyncio.Semaphore(slots) if slots else None
+        self.load_latency = load_latency
+        self.lora_latency = lora_latency
+        self.model_name = MODEL_NAME
+        self.lora_names = []
+        self.random = random.Random(seed)
+        self.stats = {"requests": 0, "prompts": 0, "failures": 0, "malformed": 0, "model_loads": 0, "lora_loads": 0}
+
+    def punctuate(self, text):
+        words = text.split()
+        sentences = []
+        sentence = []
+        for word in words:
+            if not sentence or word == 'i':
+                word = word[:1].upper() + word[1:]
+            sentence.append(word)
+            if zlib.crc32(word.lower().encode('utf-8')) % self.sentence_every == 0:
+                sentences.append(' '.join(sentence) + '.')
+                sentence = []
+        if sentence:
+            sentences.append(' '.join(sentence))
+        return '\n'.join(sentences)
+
+    def completion_text(self, prompt):
+        """The model's reply to one prompt: the prompt's JSON with "output" filled in."""
+        if self.malformed_rate and self.random.random() < self.malformed_rate:
+            self.stats["malformed"] += 1
+            return 'Formatted text: ' + prompt[:40]
+        try:
+            text = json.loads(prompt)["input"]
+        except (json.JSONDecodeError, KeyError, TypeError):
+            text = prompt
+        return json.dumps({"output": self.punctuate(text)})
+
+    def delay(self):
+        return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    async def completions(self, request):
+        self.stats["requests"] += 1
+        payload = await request.json()
+        if self.slots:
+            async with self.slots:
+                await asyncio.sleep(self.delay())
+        else:
+            await asyncio.sleep(self.delay())
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            self.stats["failures"] += 1
+            return web.json_response({"error": {"message": "injected failure"}}, status=self.failure_status)
+
+        prompts = payload.get("prompt", "")
+        if not isinstance(prompts, list):
+            prompts = [prompts]
+        self.stats["prompts"] += len(prompts)
+        texts = [self.completion_text(prompt) for prompt in prompts]
+        if payload.get("stream"):
+            return await self.stream(request, texts[0])
+
+        return web.json_response({
+            "id": f"cmpl-mock-{self.stats['requests']}",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": MODEL_NAME,
+            "choices": [
+                {"index": index, "text": text, "finish_reason": "stop"}
+                for index, text in enumerate(texts)
+            ]
+        })
+
+    async def stream(self, request, text):
+        """Sends the reply as server-sent events of a few characters each."""
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for start in range(0, len(text), 4):
+            event = {"choices": [{"index": 0, "text": text[start:start + 4], "finish_reason": None}]}
+            try:
+                await response.write(f'data: {json.dumps(event)}\n\n'.encode('utf-8'))
+            except ConnectionResetError:
+                return response
+            if self.token_latency:
+                await asyncio.sleep(self.token_latency)
+        await response.write(b'data: [DONE]\n\n')
+        await response.write_eof()
+        return response
+
+    async def models(self, request):
+        return web.json_response({"object": "list", "data": [{"id": MODEL_NAME, "object": "model"}]})
+
+    async def model_info(self, request):
+        return web.json_response({"model_name": self.model_name, "lora_names": self.lora_names})
+
+    async def load_model(self, request):
+        payload = await request.json()
+        await asyncio.sleep(self.load_latency)
+        self.stats["model_loads"] += 1
+        self.model_name = payload["model_name"]
+        self.lora_names = []
+        return web.Response(text="OK")
+
+    async def load_loras(self, request):
+        payload = await request.json()
+        await asyncio.sleep(self.lora_latency)
+        self.stats["lora_loads"] += 1
+        self.lora_names = list(payload["lora_names"])
+        return web.Response(text="OK")
+
+    async def unload_loras(self, request):
+        self.lora_names = []
+        return web.Response(text="OK")
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/v1/completions', self.completions)
+        app.router.add_get('/v1/models', self.models)
+        app.router.add_get('/v1/internal/model/info', self.model_info)
+        app.router.add_post('/v1/internal/model/load', self.load_model)
+        app.router.add_post('/v1/internal/lora/load', self.load_loras)
+        app.router.add_post('/v1/internal/lora/unload', self.unload_loras)
+        return app
+
+async def start(mock: MockCompletions, host: str = '127.0.0.1', port: int = 0):
+    """Serves mock on host:port (0 picks a free port) and returns (runner, completions URL)."""
+    runner = web.AppRunner(mock.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = runner.addresses[0][1]
+    return runner, f'http://{host}:{bound_port}/v1/completions'
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock /v1/completions API for benchmarks.")
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="uniform +/- seconds added to the latency")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="seconds between streamed events")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of requests answered with an error")
+    parser.add_argument("--failure-status", type=int, default=503, help="status code of injected errors")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of prompts answered with non-JSON text")
+    parser.add_argument("--slots", type=int, default=0, help="requests generated at once (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    mock = MockCompletions(
+        latency=args.latency, jitter=args.jitter, token_latency=args.token_latency,
+        failure_rate=args.failure_rate, failure_status=args.failure_status,
+        malformed_rate=args.malformed_rate, slots=args.slots, seed=args.seed
+    )
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None)
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,20 @@
-import requests
+import os
+import re
+import time
+import hashlib
+import asyncio
+import aiohttp
 import json
+import logging
+import argparse
+from urllib.parse import urlsplit
+import http_client
+from config import API_URL, API_REPLICAS, LORA_OUTPUT_DIR
+from replica_pool import replica_urls
 
-def load_model_via_api(
+logger = logging.getLogger(__name__)
+
+async def load_model_via_api_async(
     model_name: str,
     api_url: str = "http://localhost:5000/v1/internal/model/load",
     timeout: int = 40,
@@ -23,18 +36,20 @@ def load_model_via_api(
     }
 
     try:
-        response = requests.post(
+        session = await http_client.get_session()
+        async with session.post(
             api_url,
             json=load_params,
             headers={"Content-Type": "application/json"},
-            timeout=timeout
-        )
-        response.raise_for_status()
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            response_text = await response.text()
+            response.raise_for_status()
 
         try:
-            response_data = response.json()
+            response_data = json.loads(response_text)
         except json.JSONDecodeError:
-            response_data = {"message": response.text.strip()}
+            response_data = {"message": response_text.strip()}
 
         return {
             "success": True,
@@ -42,7 +57,7 @@ def load_model_via_api(
             "response": response_data
         }
 
-    except requests.exceptions.RequestException as e:
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         return {
             "success": False,
             "model": model_name,
@@ -55,12 +70,196 @@ def load_model_via_api(
             "error": f"Unexpected error: {str(e)}"
         }
 
-def main(model_to_load: str):
+def load_model_via_api(model_name: str, **kwargs) -> dict:
+    """
+    Synchronous wrapper around load_model_via_api_async for scripts.
+
+    """
+    return http_client.run(load_model_via_api_async(model_name, **kwargs))
+
+def server_root(api_url: str = API_URL) -> str:
+    """The scheme and host:port of a server endpoint URL."""
+    parts = urlsplit(api_url)
+    return f'{parts.scheme}://{parts.netloc}'
+
+def list_checkpoints(lora_dir: str = LORA_OUTPUT_DIR):
+    """
+    Returns the LoRA names of the trained adapter's checkpoint-N directories,
+    oldest first, then the final adapter itself. Names are relative to the
+    parent of lora_dir, the --lora-dir startlora.py gives the server.
+    """
+    parent = os.path.dirname(os.path.abspath(lora_dir))
+    name = os.path.basename(os.path.abspath(lora_dir))
+    checkpoints = []
+    if os.path.isdir(lora_dir):
+        for entry in os.scandir(lora_dir):
+            match = re.fullmatch(r'checkpoint-(\d+)', entry.name)
+            if match and entry.is_dir():
+                checkpoints.append((int(match.group(1)), f'{name}/{entry.name}'))
+    names = [checkpoint for _, checkpoint in sorted(checkpoints)]
+    if os.path.exists(os.path.join(parent, name, 'adapter_config.json')):
+        names.append(name)
+    return names
+
+class ModelRegistry:
+    """
+    Tracks the base model and LoRAs one server has loaded and changes only
+    what differs: nothing when the request matches, just the adapters when
+    the base model is unchanged (seconds instead of a full reload), and a full
+    load followed by the adapters otherwise. Switches are serialized so
+    concurrent callers never interleave loads on the same server.
+    """
+
+    def __init__(self, server_url: str = None, timeout: int = 40):
+        self.server_url = (server_url or server_root()).rstrip('/')
+        self.timeout = timeout
+        self.model = None
+        self.loras = None
+        self.load_args = None
+        self.lock = asyncio.Lock()
+
+    async def request(self, method, path, payload=None):
+        session = await http_client.get_session()
+        async with session.request(
+            method,
+            self.server_url + path,
+            json=payload,
+            timeout=aiohttp.ClientTimeout(total=self.timeout)
+        ) as response:
+            text = await response.text()
+            response.raise_for_status()
+        try:
+            return json.loads(text)
+        except json.JSONDecodeError:
+            return {"message": text.strip()}
+
+    async def refresh(self):
+        """Reads what the server has loaded right now."""
+        info = await self.request('GET', '/v1/internal/model/info')
+        model = info.get("model_name")
+        self.model = None if model in (None, "None") else model
+        self.loras = list(info.get("lora_names") or [])
+        return self.model, self.loras
+
+    async def ensure(self, model_name: str = None, loras=(), n_gpu_layers: int = None, n_ctx: int = None,
+                     **extra_args) -> dict:
+        """
+        Makes the server run model_name (None keeps the current base model)
+        with exactly the given LoRAs. Returns the outcome with the action taken:
+        "none", "adapter" or "reload".
+
+        Load arguments left as None take load_model_via_api_async's defaults.
+        The server does not report what its model was loaded with, so until
+        this registry has loaded it, explicitly requested arguments force a
+        reload; without any, the defaults are recorded as a guess.
+        """
+        loras = [loras] if isinstance(loras, str) else list(loras)
+        requested = {name: value for name, value in {"n_gpu_layers": n_gpu_layers, "n_ctx": n_ctx,
+                                                     **extra_args}.items() if value is not None}
+        load_args = {"n_gpu_layers": 41, "n_ctx": 4096, **requested}
+        async with self.lock:
+            start_time = time.monotonic()
+            result = {"success": True, "model": model_name, "loras": loras, "action": "none"}
+            try:
+                if self.model is None or self.loras is None:
+                    await self.refresh()
+                model_name = model_name or self.model
+                result["model"] = model_name
+                if model_name is None:
+                    raise ValueError("No model is loaded and none was requested")
+
+                if self.load_args is None:
+                    args_changed = bool(requested)
+                else:
+                    args_changed = any(self.load_args.get(name) != value for name, value in requested.items())
+                if model_name != self.model or args_changed:
+                    logger.info(f'Loading {model_name} on {self.server_url}')
+                    loaded = await load_model_via_api_async(
+                        model_name, api_url=self.server_url + '/v1/internal/model/load',
+                        timeout=self.timeout, **load_args
+                    )
+                    if not loaded["success"]:
+                        raise ValueError(loaded["error"])
+                    self.model, self.loras, self.load_args = model_name, [], load_args
+                    result["action"] = "reload"
+                elif self.load_args is None:
+                    logger.info(f'{model_name} was already loaded on {self.server_url} with unknown arguments; '
+                                f'assuming {load_args}, which were not applied')
+                    self.load_args = load_args
+
+                if loras != self.loras:
+                    logger.info(f'Switching {self.server_url} to LoRAs {loras or "none"}')
+                    if loras:
+                        await self.request('POST', '/v1/internal/lora/load', {"lora_names": loras})
+                    else:
+                        await self.request('POST', '/v1/internal/lora/unload')
+                    self.loras = loras
+                    if result["action"] == "none":
+                        result["action"] = "adapter"
+            except Exception as e:
+                # What the server holds is unknown after a failed load; read it again next time
+                self.model = self.loras = self.load_args = None
+                result.update(success=False, error=str(e))
+            result["seconds"] = round(time.monotonic() - start_time, 3)
+            return result
+
+def adapter_fingerprint(name: str, lora_dir: str = LORA_OUTPUT_DIR):
+    """
+    Hash of the size and modification time of a LoRA's adapter files, found
+    relative to the parent of lora_dir as the server finds them, so an adapter
+    retrained in place under the same name gets a new fingerprint. None when
+    the adapter is not on this machine.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(lora_dir)), name)
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha1()
+    for entry in sorted(os.scandir(path), key=lambda entry: entry.name):
+        if entry.name.startswith('adapter_') and entry.is_file():
+            stat = entry.stat()
+            digest.update(f'{entry.name}:{stat.st_size}:{stat.st_mtime_ns};'.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+async def served_model(urls, timeout: int = 10):
+    """
+    Describes what the servers at urls are serving: the base model, then each
+    LoRA with its adapter_fingerprint, e.g. "base|model-out@1a2b...". Returns
+    None when a server cannot tell or the servers disagree.
+    """
+    identities = set()
+    for url in urls:
+        registry = ModelRegistry(server_root(url), timeout)
+        try:
+            model, loras = await registry.refresh()
+        except Exception as e:
+            logger.warning(f'Cannot read what {registry.server_url} is serving: {e}')
+            return None
+        if model is None:
+            return None
+        identities.add('|'.join([model] + [f'{lora}@{adapter_fingerprint(lora)}' for lora in loras]))
+    if len(identities) != 1:
+        logger.warning(f'Servers are serving different models: {sorted(identities)}')
+        return None
+    return identities.pop()
+
+async def ensure_all(registries, model_name: str = None, loras=(), **load_args):
+    """Switches every replica at once, so the pool is down for one switch rather than one per replica."""
+    return await asyncio.gather(*(registry.ensure(model_name, loras, **load_args) for registry in registries))
+
+def replica_registries(api_url: str = API_URL, replicas: int = API_REPLICAS, timeout: int = 40):
+    """One registry per server that ParseFile balances requests across."""
+    return [ModelRegistry(server_root(url), timeout) for url in replica_urls(api_url, replicas)]
+
+def main(model_to_load: str, loras=(), replicas: int = API_REPLICAS, gpu_layers: int = None, ctx_size: int = None):
     """
     Main function to initiate model loading via API.
 
     Args:
         model_to_load: The name of the model to be loaded.
+        loras: LoRA names to apply on top of it.
+        replicas: Servers on consecutive ports to switch together.
+        gpu_layers: n_gpu_layers to load with; forces a reload when given.
+        ctx_size: n_ctx to load with; forces a reload when given.
     """
     print(f"Attempting to load model: {model_to_load}")
 
@@ -68,25 +267,37 @@ def main(model_to_load: str):
     # Adjust n_gpu_layers and n_ctx based on your system's VRAM
     # and the model's requirements.
 
-    # Default/Conservative settings
-    gpu_layers = 41  
-    ctx_size = 4096
+    # None keeps the Default/Conservative settings (41 layers, 4096 context)
+    # and does not reload a model that is already loaded
 
-    load_result = load_model_via_api(
+    registries = replica_registries(replicas=replicas)
+    load_results = http_client.run(ensure_all(
+        registries,
         model_name=model_to_load,
+        loras=loras,
         n_gpu_layers=gpu_layers,
         n_ctx=ctx_size
-    )
+    ))
 
-    if load_result["success"]:
-        print(f"Successfully loaded model: {load_result['model']}")
-        print("API Response:", json.dumps(load_result["response"], indent=2))
-    else:
-        print(f"Failed to load model: {load_result['model']}")
-        print("Error:", load_result["error"])
-        if "response" in load_result:
-            print("API Response (if available):", json.dumps(load_result["response"], indent=2))
+    for registry, load_result in zip(registries, load_results):
+        if load_result["success"]:
+            print(f"{registry.server_url}: {load_result['model']} with LoRAs {load_result['loras'] or 'none'} "
+                  f"({load_result['action']}, {load_result['seconds']}s)")
+        else:
+            print(f"Failed to load model: {load_result['model']} on {registry.server_url}")
+            print("Error:", load_result["error"])
 
 if __name__ == "__main__":
-    model_name_to_load = "mythomakisemerged-13b.Q5_K_S.gguf"
-    main(model_name_to_load)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load a model and LoRAs on the server, skipping what is already loaded.")
+    parser.add_argument("model", nargs="?", default="mythomakisemerged-13b.Q5_K_S.gguf",
+                        help="base model to load (unchanged models are not reloaded)")
+    parser.add_argument("--lora", action="append", default=[], help="LoRA to apply; repeat for several")
+    parser.add_argument("--replicas", type=int, default=API_REPLICAS, help="servers on consecutive ports to switch")
+    parser.add_argument("--n-gpu-layers", type=int, help="layers to offload to the GPU (reloads the model)")
+    parser.add_argument("--n-ctx", type=int, help="context size (reloads the model)")
+    parser.add_argument("--list-checkpoints", action="store_true", help=f"list the LoRAs in {LORA_OUTPUT_DIR} and exit")
+    args = parser.parse_args()
+    if args.list_checkpoints:
+        print("\n".join(list_checkpoints()))
+    else:
+        main(args.model, args.lora, args.replicas, args.n_gpu_layers, args.n_ctx)
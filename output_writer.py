@@ -0,0 +1,75 @@
+import os
+
+class OutputWriter:
+    """
+    Appends committed output segments to a file as soon as they are final, so
+    the document never has to be held in memory and the file can be tailed
+    during a run. Segments go to path + '.partial', which commit() moves over
+    path, so a run that fails leaves the previous output in place. The file
+    ends up holding the stripped concatenation of the segments: leading
+    whitespace is dropped and whitespace is only written once more text
+    follows it.
+    """
+
+    def __init__(self, path, state=None):
+        self.path = path
+        self.partial_path = path + '.partial'
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if state:
+            self.file = open(self.partial_path, 'r+', encoding='utf-8')
+            self.file.seek(state["offset"])
+            self.file.truncate()
+            self.started = state["started"]
+            self.pending_whitespace = state["pending_whitespace"]
+            self.last_char = state["last_char"]
+        else:
+            self.file = open(self.partial_path, 'w', encoding='utf-8')
+            self.started = False
+            self.pending_whitespace = ""
+            self.last_char = ""
+
+    def append(self, part):
+        """Adds a segment, separating it from the previous one with a space."""
+        if self.last_char and self.last_char not in (' ', '\n'):
+            self.emit(' ')
+        self.emit(part)
+
+    def emit(self, text):
+        if not text:
+            return
+        self.last_char = text[-1]
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return
+            self.started = True
+        body = text.rstrip()
+        trailing = text[len(body):]
+        if body:
+            self.file.write(self.pending_whitespace + body)
+            self.pending_whitespace = trailing
+        else:
+            self.pending_whitespace += trailing
+        self.file.flush()
+
+    def state(self):
+        """Returns what a checkpoint needs to reopen the file at this point."""
+        self.file.flush()
+        return {
+            "offset": self.file.tell(),
+            "started": self.started,
+            "pending_whitespace": self.pending_whitespace,
+            "last_char": self.last_char
+        }
+
+    def close(self):
+        """Closes the partial file, keeping it for a checkpoint to resume."""
+        if not self.file.closed:
+            self.file.close()
+
+    def commit(self):
+        """Closes the finished output and moves it over path."""
+        self.close()
+        os.replace(self.partial_path, self.path)
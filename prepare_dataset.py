@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# prepare_dataset.py
+import os
+import json
+import shutil
+import hashlib
+import logging
+import argparse
+from config import TOKENIZER_DIR, DATASET_FILE, DATASET_PRETOKENIZED_DIR, SEQUENCE_LEN, AXOLOTL_PREPARED_DIR
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ARROW_FILE = 'data-00000-of-00001.arrow'
+INDEX_FILE = 'record_hashes.json'
+LOCK_FILE = 'datasets_prep.lock'
+FEATURES = {
+    "input_ids": {"feature": {"dtype": "int32", "_type": "Value"}, "_type": "Sequence"},
+    "attention_mask": {"feature": {"dtype": "int8", "_type": "Value"}, "_type": "Sequence"},
+    "labels": {"feature": {"dtype": "int64", "_type": "Value"}, "_type": "Sequence"}
+}
+
+class AlpacaTokenizer:
+    """
+    Tokenizes instruction/input/output records the way axolotl's `alpaca` type
+    does: the prompt template is tokenized with BOS, the output without it and
+    followed by EOS, and the prompt tokens are masked out of the labels.
+    """
+
+    SYSTEM = ("Below is an instruction that describes a task, paired with an input that provides "
+              "further context. Write a response that appropriately completes the request.\n\n")
+    NO_INPUT_SYSTEM = ("Below is an instruction that describes a task. "
+                       "Write a response that appropriately completes the request.\n\n")
+    TURN = "### Instruction:\n{instruction}\n\n### Input:\n{input}\n\n### Response:\n"
+    NO_INPUT_TURN = "### Instruction:\n{instruction}\n\n### Response:\n"
+
+    def __init__(self, tokenizer_dir: str = TOKENIZER_DIR, sequence_len: int = SEQUENCE_LEN):
+        tokenizer_json = os.path.join(tokenizer_dir, 'tokenizer.json')
+        if Tokenizer is None:
+            raise ValueError("Pre-tokenizing needs the tokenizers package")
+        if not os.path.exists(tokenizer_json):
+            raise ValueError(f"No tokenizer.json in {tokenizer_dir}")
+        self.tokenizer = Tokenizer.from_file(tokenizer_json)
+        with open(os.path.join(tokenizer_dir, 'tokenizer_config.json'), 'r', encoding='utf-8') as f:
+            eos_token = json.load(f)["eos_token"]
+        self.eos_id = self.tokenizer.token_to_id(eos_token if isinstance(eos_token, str) else eos_token["content"])
+        self.sequence_len = sequence_len
+
+        # Rows can only be reused while the tokenizer, template and length limit are unchanged
+        fingerprint = hashlib.sha1()
+        with open(tokenizer_json, 'rb') as f:
+            fingerprint.update(f.read())
+        settings = [self.eos_id, sequence_len, self.SYSTEM, self.NO_INPUT_SYSTEM, self.TURN, self.NO_INPUT_TURN]
+        fingerprint.update(json.dumps(settings).encode('utf-8'))
+        self.fingerprint = fingerprint.hexdigest()
+
+    def prompt(self, record):
+        if record.get("input"):
+            return self.SYSTEM + self.TURN.format(instruction=record["instruction"], input=record["input"])
+        return self.NO_INPUT_SYSTEM + self.NO_INPUT_TURN.format(instruction=record["instruction"])
+
+    def tokenize(self, record):
+        """Returns the row's input_ids, attention_mask and labels, or None if it exceeds sequence_len."""
+        prompt_ids = self.tokenizer.encode(self.prompt(record)).ids
+        output_ids = self.tokenizer.encode(record["output"], add_special_tokens=False).ids + [self.eos_id]
+        input_ids = prompt_ids + output_ids
+        if len(input_ids) > self.sequence_len:
+            return None
+        return {
+            "input_ids": input_ids,
+            "attention_mask": [1] * len(input_ids),
+            "labels": [-100] * len(prompt_ids) + output_ids
+        }
+
+def read_records(paths):
+    """Yields the records of one or more JSONL files, skipping blank lines."""
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+def record_hash(record):
+    return hashlib.sha1(json.dumps(record, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def arrow_schema():
+    return pyarrow.schema(
+        [
+            ("input_ids", pyarrow.list_(pyarrow.int32())),
+            ("attention_mask", pyarrow.list_(pyarrow.int8())),
+            ("labels", pyarrow.list_(pyarrow.int64()))
+        ],
+        metadata={"huggingface": json.dumps({"info": {"features": FEATURES}})}
+    )
+
+def load_previous(directory, fingerprint):
+    """
+    Memory-maps the rows of an earlier preparation in directory when it was made
+    with the same tokenizer settings. Returns (table, row position by record
+    hash, hashes dropped as too long), or (None, {}, set()) when nothing can be reused.
+    """
+    index_file = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return None, {}, set()
+    with open(index_file, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    if index.get("fingerprint") != fingerprint:
+        logger.info(f'Tokenizer settings changed since {directory} was prepared, re-tokenizing everything')
+        return None, {}, set()
+    with pyarrow.memory_map(os.path.join(directory, ARROW_FILE)) as source:
+        table = pyarrow.ipc.open_stream(source).read_all()
+    if table.num_rows != len(index["hashes"]):
+        logger.warning(f'{index_file} does not match its Arrow file, re-tokenizing everything')
+        return None, {}, set()
+    positions = {}
+    for position, digest in enumerate(index["hashes"]):
+        positions.setdefault(digest, position)
+    return table, positions, set(index.get("dropped", []))
+
+def write_prepared(table, directory, index):
+    """
+    Writes a table as a datasets save_to_disk directory: an Arrow IPC stream
+    that load_from_disk memory-maps, plus dataset_info.json and state.json.
+    INDEX_FILE records which record produced each row. The directory is
+    replaced atomically.
+    """
+    temp_dir = directory.rstrip('/') + '.tmp'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    with pyarrow.OSFile(os.path.join(temp_dir, ARROW_FILE), 'wb') as sink:
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    fingerprint = hashlib.sha1(json.dumps(index, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    with open(os.path.join(temp_dir, 'dataset_info.json'), 'w', encoding='utf-8') as f:
+        json.dump({"citation": "", "description": "", "features": FEATURES, "homepage": "", "license": ""}, f, indent=2)
+    with open(os.path.join(temp_dir, 'state.json'), 'w', encoding='utf-8') as f:
+        json.dump({
+            "_data_files": [{"filename": ARROW_FILE}],
+            "_fingerprint": fingerprint,
+            "_format_columns": None,
+            "_format_kwargs": {},
+            "_format_type": None,
+            "_output_all_columns": False,
+            "_split": None
+        }, f, indent=2)
+    with open(os.path.join(temp_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_dir, directory)
+
+def prepare(records, directory, tokenizer: AlpacaTokenizer = None):
+    """
+    Tokenizes records into directory incrementally. Every record is keyed by
+    the hash of its content; rows already in the previous preparation of
+    directory are copied from its memory-mapped Arrow file, so only new or
+    changed records are tokenized. Returns counts of rows written, reused,
+    tokenized and dropped as too long.
+    """
+    if pyarrow is None:
+        raise ValueError("Writing Arrow datasets needs the pyarrow package")
+    tokenizer = tokenizer or AlpacaTokenizer()
+    previous, positions, previously_dropped = load_previous(directory, tokenizer.fingerprint)
+    offset = previous.num_rows if previous is not None else 0
+
+    hashes = []
+    dropped = set()
+    order = []
+    new_rows = []
+    stats = {"written": 0, "reused": 0, "tokenized": 0, "dropped": 0}
+    for record in records:
+        digest = record_hash(record)
+        if digest in positions:
+            order.append(positions[digest])
+            hashes.append(digest)
+            if positions[digest] < offset:
+                stats["reused"] += 1
+            continue
+        if digest in previously_dropped or digest in dropped:
+            dropped.add(digest)
+            continue
+        row = tokenizer.tokenize(record)
+        stats["tokenized"] += 1
+        if row is None:
+            dropped.add(digest)
+            continue
+        positions[digest] = offset + len(new_rows)
+        order.append(positions[digest])
+        hashes.append(digest)
+        new_rows.append(row)
+    stats["written"] = len(order)
+    stats["dropped"] = len(dropped)
+    if dropped:
+        logger.warning(f'Dropped {len(dropped)} examples longer than {tokenizer.sequence_len} tokens')
+
+    index = {"fingerprint": tokenizer.fingerprint, "hashes": hashes, "dropped": sorted(dropped)}
+    if previous is not None and order == list(range(offset)) and dropped == previously_dropped:
+        logger.info(f'{directory} is up to date')
+        return stats
+
+    schema = arrow_schema()
+    table = pyarrow.Table.from_pydict({column: [row[column] for row in new_rows] for column in FEATURES}, schema=schema)
+    if previous is not None:
+        table = pyarrow.concat_tables([previous.cast(schema), table]).take(order)
+    write_prepared(table, directory, index)
+    return stats
+
+def collect_garbage(prepared_root: str = AXOLOTL_PREPARED_DIR, keep: int = 1):
+    """
+    Removes the prepared directories axolotl has left in prepared_root, keeping
+    the `keep` most recently written. Skipped while axolotl holds
+    datasets_prep.lock. Returns the removed paths.
+    """
+    if not os.path.isdir(prepared_root):
+        return []
+    lock_path = os.path.join(prepared_root, LOCK_FILE)
+    with open(lock_path, 'a') as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                logger.warning(f'{lock_path} is held, not collecting prepared datasets')
+                return []
+        prepared = [
+            entry.path for entry in os.scandir(prepared_root)
+            if entry.is_dir() and os.path.exists(os.path.join(entry.path, 'state.json'))
+        ]
+        prepared.sort(key=os.path.getmtime, reverse=True)
+        removed = prepared[max(0, keep):]
+        for path in removed:
+            shutil.rmtree(path)
+            logger.info(f'Removed orphaned prepared dataset {path}')
+    return removed
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Pre-tokenize alpaca JSONL into an Arrow dataset axolotl can load without preprocessing."
+    )
+    parser.add_argument("inputs", nargs="*", default=[DATASET_FILE], help="JSONL files (default: DATASET_FILE)")
+    parser.add_argument("--output", default=DATASET_PRETOKENIZED_DIR, help="dataset directory to write or update")
+    parser.add_argument("--tokenizer-dir", default=TOKENIZER_DIR)
+    parser.add_argument("--sequence-len", type=int, default=SEQUENCE_LEN)
+    parser.add_argument("--gc", action="store_true",
+                        help="remove stale axolotl prepared datasets from AXOLOTL_PREPARED_DIR")
+    parser.add_argument("--keep", type=int, default=1, help="prepared datasets --gc keeps")
+    args = parser.parse_args()
+
+    tokenizer = AlpacaTokenizer(args.tokenizer_dir, args.sequence_len)
+    stats = prepare(read_records(args.inputs), args.output, tokenizer)
+    print(f'{stats["written"]} examples in {args.output}: {stats["reused"]} reused, '
+          f'{stats["tokenized"]} tokenized, {stats["dropped"]} too long')
+    print(f'Point axolotl at it with a datasets entry of `path: {os.path.abspath(args.output)}` and no type')
+    if args.gc:
+        removed = collect_garbage(AXOLOTL_PREPARED_DIR, args.keep)
+        print(f'Removed {len(removed)} stale prepared datasets from {AXOLOTL_PREPARED_DIR}')
+
+if __name__ == "__main__":
+    main()
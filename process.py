@@ -1,36 +1,94 @@
 import os
 import re
+import argparse
 import logging
 from logger import configure_logging
 import textwrap
 import aiohttp
 import asyncio
 import json
+import hashlib
+import random
+import itertools
+import collections
 from config import (
-    API_URL, API_TIMEOUT, MAX_TOKENS, STOP_SEQUENCES, TEST_MODE,
-    REPETITION_PENALTY, TEMPERATURE, TOP_P, TOP_K, SENTENCE_MARKER,
+    API_URL, API_TIMEOUT, API_REPLICAS, MAX_TOKENS, STOP_SEQUENCES, TEST_MODE,
+    REPETITION_PENALTY, TEMPERATURE, TOP_P, TOP_K,
     CHUNK_OVERLAP, OUTPUT_CHUNK_SIZE, TEST_INPUT, TEST_OUTPUT, DESIRED_OUTPUT,
-    PROCESSED_FILE, POSTPROCESSED_FILE, TEST_FILE, TRAINING_FILE
+    PROCESSED_FILE, POSTPROCESSED_FILE, TEST_FILE, TRAINING_FILE,
+    PIPELINE_CONCURRENCY, TRAINING_BATCH_SIZE, RESPONSE_CACHE,
+    CHECKPOINT_FILE, CHECKPOINT_INTERVAL, PREPROCESS_BLOCK_SIZE,
+    MAX_RETRIES, RETRY_BACKOFF, RETRY_BACKOFF_MAX, HEDGE_AFTER,
+    COMPLETION_BATCH_SIZE, COMPLETION_BATCH_WAIT, STREAM_RESPONSES, STREAM_ABORT_ON_DRIFT,
+    ADAPTIVE_CHUNKS, ADAPTIVE_OVERLAP, METRICS_FILE, METRICS_PROMETHEUS_FILE
 )
+import http_client
+from response_cache import ResponseCache
+from output_writer import OutputWriter
+from completion_batcher import CompletionBatcher
+from replica_pool import ReplicaPool, replica_urls
+from stream_parser import StreamingOutput
+from token_budget import TokenCounter
+from metrics import Metrics
+from model_loader import served_model
+import quality
+from deformat import deformat_text
+
+RETRY_STATUSES = (408, 429)
+SENTENCE_END = re.compile(r'[.!?]["\')\]]*(?=\n)')
+
+class APIError(ValueError):
+    """A failed completions request; `retryable` marks failures worth another attempt."""
+
+    def __init__(self, message, retryable=False):
+        super().__init__(message)
+        self.retryable = retryable
 
 class ParseFile:
-    def __init__(self):
+    INDEX_NGRAM = 4
+
+    def __init__(self, concurrency: int = PIPELINE_CONCURRENCY, use_cache: bool = RESPONSE_CACHE,
+                 batcher: CompletionBatcher = None, mode: str = TEST_MODE, api_url: str = API_URL,
+                 desired_file: str = None, training_file: str = TRAINING_FILE, replicas: int = API_REPLICAS,
+                 pool: ReplicaPool = None):
         self.input_string = ""
         self.chunk = ""
         self.output_string = ""
         self._cleaned = False
-        self.api_url = API_URL
+        self.api_url = api_url
+        self.pool = pool or ReplicaPool(replica_urls(api_url, replicas))
+        self.mode = mode
+        self.desired_file = desired_file or os.path.join("files", DESIRED_OUTPUT)
+        self.training_file = training_file
         self.logger = logging.getLogger(__name__)
         self.session = None
         self.input_array = []
+        self.input_word_pointer = 0
+        self.desired_index = None
+        self.training_hashes = None
+        self.training_buffer = []
+        self.concurrency = max(1, concurrency)
+        self.retry_count = 0
+        self.checkpoint_file = CHECKPOINT_FILE
+        self.chunk_count = 0
+        self.token_counter = None
+        self.overlap_tokens_saved = 0
+        self.metrics = Metrics()
+        self.batcher = batcher
+        if self.batcher is None and COMPLETION_BATCH_SIZE > 1:
+            self.batcher = CompletionBatcher(self.post_completion, COMPLETION_BATCH_SIZE, COMPLETION_BATCH_WAIT)
+        self.use_cache = use_cache
+        self.cache = None
+        self.cache_lock = asyncio.Lock()
 
     async def __aenter__(self):
-        self.session = aiohttp.ClientSession()
+        self.session = await http_client.get_session()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.session:
-            await self.session.close()
+        self.flush_training_pairs()
+        if self.cache:
+            self.cache.close()
 
     def loadchunk(self, word_count):
         words_loaded = 0
@@ -51,7 +109,9 @@ class ParseFile:
         Raises exceptions for any failures to force proper error handling upstream.
         """
         if self.session is None:
-            self.session = aiohttp.ClientSession()
+            self.session = await http_client.get_session()
+        if self.use_cache and self.cache is None:
+            await self.open_cache()
         
         # Prepare the structured prompt matching the training data format
         prompt = {
@@ -60,69 +120,267 @@ class ParseFile:
             "output": ""
         }
 
-        async with self.session.post(
-            API_URL,
-            json={
-                "prompt": json.dumps(prompt),
-                "max_tokens": MAX_TOKENS,
-                "temperature": TEMPERATURE,
-                "stop": STOP_SEQUENCES,
-                "repetition_penalty": REPETITION_PENALTY,
-                "top_p": TOP_P,
-                "top_k": TOP_K
-            },
+        payload = {
+            "prompt": json.dumps(prompt),
+            "max_tokens": MAX_TOKENS,
+            "temperature": TEMPERATURE,
+            "stop": STOP_SEQUENCES,
+            "repetition_penalty": REPETITION_PENALTY,
+            "top_p": TOP_P,
+            "top_k": TOP_K
+        }
+        if STREAM_RESPONSES:
+            payload["stream"] = True
+
+        if self.cache:
+            cached = self.cache.get(payload)
+            if cached is not None:
+                self.metrics.count("cache_hits")
+                return cached
+
+        formatted_text = await self.request_with_retries(payload)
+
+        if self.cache:
+            self.cache.put(payload, formatted_text)
+
+        return formatted_text
+
+    async def open_cache(self):
+        """
+        Opens the response cache keyed on what the servers report serving. The
+        cache is switched off for this run when they cannot report it.
+        """
+        async with self.cache_lock:
+            if self.cache is not None or not self.use_cache:
+                return
+            model = await served_model([replica.url for replica in self.pool.replicas])
+            if model is None:
+                self.logger.warning('Cannot tell which model and LoRAs are served, not using the response cache')
+                self.use_cache = False
+                return
+            self.cache = ResponseCache(model=model)
+
+    async def post_completion(self, payload):
+        """Posts a completions request to the least busy replica and returns the decoded JSON response."""
+        async with self.pool.acquire() as api_url, self.session.post(
+            api_url,
+            json=payload,
             timeout=aiohttp.ClientTimeout(total=API_TIMEOUT)
         ) as response:
             # Strict status code checking
             if response.status != 200:
                 error_content = await response.text()
-                raise ValueError(f"API request failed with status {response.status}: {error_content}")
-            
-            result = await response.json()
-            
-            # Strict response parsing - expect properly formatted JSON response
-            if not result.get("choices"):
-                raise ValueError("Invalid API response format: missing 'choices' field")
-            
-            response_text = result["choices"][0].get("text", "").strip()
-            if not response_text:
-                raise ValueError("Empty response from model")
+                raise APIError(
+                    f"API request failed with status {response.status}: {error_content}",
+                    retryable=response.status >= 500 or response.status in RETRY_STATUSES
+                )
             
-            # Parse the JSON response from the model
             try:
+                return await response.json()
+            except (aiohttp.ContentTypeError, json.JSONDecodeError) as e:
+                raise APIError(f"Invalid API response body: {str(e)}", retryable=True)
+
+    async def stream_completion(self, payload):
+        """
+        Streams the completion as server-sent events and decodes the "output" string
+        as tokens arrive. The request is dropped as soon as the output has covered
+        every input word or has drifted from them, instead of running to MAX_TOKENS.
+        """
+        input_words = self.deformat(json.loads(payload["prompt"])["input"]).split()
+        parser = StreamingOutput(input_words, self.deformat, STREAM_ABORT_ON_DRIFT)
+        state = "continue"
+        with self.metrics.time("http_wait"):
+            async with self.pool.acquire() as api_url, self.session.post(
+                api_url,
+                json=payload,
+                timeout=aiohttp.ClientTimeout(total=API_TIMEOUT)
+            ) as response:
+                if response.status != 200:
+                    error_content = await response.text()
+                    raise APIError(
+                        f"API request failed with status {response.status}: {error_content}",
+                        retryable=response.status >= 500 or response.status in RETRY_STATUSES
+                    )
+
+                async for line in response.content:
+                    line = line.decode('utf-8').strip()
+                    if not line.startswith('data:'):
+                        continue
+                    data = line[len('data:'):].strip()
+                    if data == '[DONE]':
+                        break
+                    try:
+                        event = json.loads(data)
+                    except json.JSONDecodeError as e:
+                        raise APIError(f"Invalid stream event: {str(e)}", retryable=True)
+                    choices = event.get("choices") or [{}]
+                    with self.metrics.time("parse"):
+                        state = parser.feed(choices[0].get("text", ""))
+                    if state != "continue":
+                        break
+                response.close()
+
+        if state == "drift":
+            raise APIError("Model output drifted from the input words", retryable=True)
+        if state == "continue":
+            raise APIError("Invalid model output format: stream ended before the output was complete",
+                           retryable=True)
+        if state == "covered":
+            self.logger.debug(f'Stopped generation after {len(input_words)} words')
+        formatted_text = parser.result()
+        if not formatted_text:
+            raise APIError("Model returned empty formatted text", retryable=True)
+        self.count_tokens(payload, formatted_text)
+        return formatted_text
+
+    async def request_completion(self, payload):
+        """Sends one completions request and returns the model's formatted output."""
+        self.metrics.count("requests")
+        if payload.get("stream"):
+            return await self.stream_completion(payload)
+        with self.metrics.time("http_wait"):
+            if self.batcher:
+                result = await self.batcher.submit(payload)
+            else:
+                result = await self.post_completion(payload)
+
+        # Strict response parsing - expect properly formatted JSON response
+        if not result.get("choices"):
+            raise APIError("Invalid API response format: missing 'choices' field", retryable=True)
+        
+        response_text = result["choices"][0].get("text", "").strip()
+        if not response_text:
+            raise APIError("Empty response from model", retryable=True)
+        
+        # Parse the JSON response from the model
+        try:
+            with self.metrics.time("parse"):
                 response_data = json.loads(response_text)
                 formatted_text = response_data["output"]
-            except (json.JSONDecodeError, KeyError) as e:
-                raise ValueError(f"Invalid model output format: {str(e)}")
+        except (json.JSONDecodeError, KeyError, TypeError) as e:
+            raise APIError(f"Invalid model output format: {str(e)}", retryable=True)
+        
+        if not formatted_text:
+            raise APIError("Model returned empty formatted text", retryable=True)
             
-            if not formatted_text:
-                raise ValueError("Model returned empty formatted text")
-                
-            return formatted_text
+        self.count_tokens(payload, formatted_text, result.get("usage"))
+        return formatted_text
+
+    def count_tokens(self, payload, formatted_text, usage=None):
+        """Adds a request's prompt and completion tokens, as reported by the server or counted locally."""
+        if usage and "prompt_tokens" in usage and "completion_tokens" in usage:
+            tokens_in, tokens_out = usage["prompt_tokens"], usage["completion_tokens"]
+        else:
+            if self.token_counter is None:
+                self.token_counter = TokenCounter()
+            tokens_in = self.token_counter.count(payload["prompt"])
+            tokens_out = self.token_counter.count(formatted_text)
+        self.metrics.count("tokens_in", tokens_in)
+        self.metrics.count("tokens_out", tokens_out)
+
+    async def hedged_request(self, payload):
+        """
+        Sends a duplicate request when the first has not answered within
+        HEDGE_AFTER seconds and returns whichever succeeds first.
+        """
+        started = []
+        try:
+            started.append(asyncio.create_task(self.request_completion(payload)))
+            if HEDGE_AFTER:
+                done, _ = await asyncio.wait(started, timeout=HEDGE_AFTER)
+                if not done:
+                    self.logger.debug(f'No response after {HEDGE_AFTER}s, sending hedged request')
+                    started.append(asyncio.create_task(self.request_completion(payload)))
+
+            tasks = set(started)
+            error = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Cancelled or not, no request outlives the call
+            for task in started:
+                self.discard(task)
+            await asyncio.gather(*started, return_exceptions=True)
+
+    async def request_with_retries(self, payload):
+        """
+        Retries failed requests up to MAX_RETRIES times with exponential backoff and
+        full jitter. Connection errors, timeouts, 5xx/429/408 responses and malformed
+        model output are retried; other client errors are raised immediately.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                return await self.hedged_request(payload)
+            except (aiohttp.ClientError, asyncio.TimeoutError, APIError) as e:
+                if isinstance(e, APIError) and not e.retryable:
+                    raise
+                if attempt == MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+                self.retry_count += 1
+                self.metrics.count("retries")
+                self.logger.warning(f'Request failed ({type(e).__name__}: {e}), retry {attempt + 1}/{MAX_RETRIES} in {delay:.1f}s')
+                await asyncio.sleep(delay)
 
     def deformat(self, formatted_output):
-        protected = formatted_output.replace('\n', SENTENCE_MARKER)
-        output = protected.lower()
-        output = re.sub(f'[^a-z\\s{re.escape(SENTENCE_MARKER)}]', '', output)
-        return output.replace(SENTENCE_MARKER, ' ')
+        return deformat_text(formatted_output, letters_only=True)
 
-    def preprocess(self, input_file):
-        self.input_file = input_file
-        self.logger.debug(f'Preprocessing: {self.input_file}')
+    def normalize(self, text):
+        text = text.lower()
+        text = text.replace("'", "'").replace('"', '"')
+        text = text.replace("—", " -- ")
+        return re.sub(r"[^a-z0-9'\-\s]", " ", text)
+
+    def input_words(self, formatted_output):
+        """
+        The input words formatted text stands for: each token goes through
+        deformat.py, iter_words' normalization and deformat, like the words of
+        an unformatted copy. "***" stands for none, "you—come" for two.
+        """
+        return [word for token in formatted_output.split()
+                for word in self.deformat(self.normalize(deformat_text(token))).split()]
+
+    def iter_words(self, input_file):
+        """
+        Yields the normalized words of input_file while reading it in blocks of
+        PREPROCESS_BLOCK_SIZE characters, so memory does not grow with the file.
+        Normalization is per character, so a word cut by a block boundary is
+        carried over and joined with the start of the next block.
+        """
+        self.logger.debug(f'Preprocessing: {input_file}')
         try:
-            with open(self.input_file, 'r', encoding='utf-8') as f:
-                text = f.read()
+            carry = ''
+            with open(input_file, 'r', encoding='utf-8') as f:
+                while True:
+                    with self.metrics.time("preprocess"):
+                        block = f.read(PREPROCESS_BLOCK_SIZE)
+                        if block:
+                            text = carry + self.normalize(block)
+                            words = text.split()
+                            carry = words.pop() if words and not text[-1].isspace() else ''
+                    if not block:
+                        break
+                    yield from words
+            if carry:
+                yield carry
 
-            text = text.lower()
-            text = text.replace("'", "'").replace('"', '"')
-            text = text.replace("—", " -- ")
-            text = re.sub(r"[^a-z0-9'\-\s]", " ", text)
-            text = re.sub(r'\s+', ' ', text).strip()
+        except Exception as e:
+            self.logger.error(f'Preprocessing failed: {e}', exc_info=True)
+            raise
 
-            words = [word for word in text.split(' ') if word]
+    def preprocess(self, input_file):
+        self.input_file = input_file
+        try:
+            words = list(self.iter_words(input_file))
             cleaned_text = ' '.join(words)
             self.input_string = cleaned_text
             self.input_array = words
+            self.desired_index = None
             self.textsize = len(cleaned_text)
             return cleaned_text
 
@@ -130,6 +388,58 @@ class ParseFile:
             self.logger.error(f'Preprocessing failed: {e}', exc_info=True)
             raise
 
+    def build_desired_index(self):
+        """
+        Aligns the deformatted input words with the words of the desired output.
+        Input positions are indexed by their opening n-gram and every position maps
+        to a (line, word) location in the desired output, so a chunk lookup costs
+        O(chunk) instead of a scan of the whole document. A desired token gets
+        one location per word of input_words, so location N belongs to input
+        word N.
+        """
+        input_words = []
+        for word in self.iter_words(self.input_file):
+            input_words.extend(self.deformat(word).split())
+        ngrams = {}
+        unigrams = {}
+        for i, word in enumerate(input_words):
+            ngrams.setdefault(tuple(input_words[i:i + self.INDEX_NGRAM]), []).append(i)
+            unigrams.setdefault(word, []).append(i)
+
+        with open(self.desired_file, "r", encoding='utf-8') as f:
+            lines = f.read().split('\n')
+
+        line_words = [line.strip().split() for line in lines]
+        word_locations = []
+        for line_index, words_in_line in enumerate(line_words):
+            for word_index, word in enumerate(words_in_line):
+                word_locations.extend([(line_index, word_index)] * len(self.input_words(word)))
+
+        return {
+            'input_words': input_words,
+            'ngrams': ngrams,
+            'unigrams': unigrams,
+            'lines': lines,
+            'line_words': line_words,
+            'word_locations': word_locations
+        }
+
+    def find_input_offset(self, target_words):
+        """Returns the first input position where target_words occurs."""
+        num_words = len(target_words)
+        if num_words == 0:
+            return 0
+        index = self.desired_index
+        if num_words >= self.INDEX_NGRAM:
+            candidates = index['ngrams'].get(tuple(target_words[:self.INDEX_NGRAM]), [])
+        else:
+            candidates = index['unigrams'].get(target_words[0], [])
+        input_words = index['input_words']
+        for i in candidates:
+            if input_words[i:i + num_words] == target_words:
+                return i
+        raise ValueError("Chunk not found in input_string.")
+
     def getdesiredchunk(self, text):
         try:
             # Preserve trailing whitespace but remove leading whitespace
@@ -139,33 +449,24 @@ class ParseFile:
             target_words = stripped_text.split()
             num_words = len(target_words)
 
-            input_words = self.deformat(self.input_string).strip().split()
-            for i in range(len(input_words) - num_words + 1):
-                if input_words[i:i + num_words] == target_words:
-                    start_word_index = i
-                    break
-            else:
-                raise ValueError("Chunk not found in input_string.")
-
-            with open(os.path.join("files", DESIRED_OUTPUT), "r", encoding='utf-8') as f:
-                desired_content = f.read()
-                lines = desired_content.split('\n')
+            if self.desired_index is None:
+                self.desired_index = self.build_desired_index()
+            index = self.desired_index
 
-            word_locations = []
-            for line_index, line in enumerate(lines):
-                words_in_line = line.strip().split()
-                for word_index, word in enumerate(words_in_line):
-                    word_locations.append((line_index, word_index))
+            start_word_index = self.find_input_offset(target_words)
+            lines = index['lines']
+            line_words = index['line_words']
+            word_locations = index['word_locations']
 
             if start_word_index + num_words > len(word_locations):
                 raise ValueError("Chunk exceeds length of desired output.")
 
-            chunk_locations = word_locations[start_word_index:start_word_index + num_words]
+            # A token holding several input words is emitted once
+            chunk_locations = list(dict.fromkeys(word_locations[start_word_index:start_word_index + num_words]))
             line_buffer = {}
             for line_index, word_index in chunk_locations:
                 original_line = lines[line_index]
-                words_in_line = original_line.strip().split()
-                word = words_in_line[word_index]
+                word = line_words[line_index][word_index]
                 
                 if line_index not in line_buffer:
                     line_buffer[line_index] = {'words': [], 'line_end': original_line.endswith(('.', '?', '!'))}
@@ -193,7 +494,7 @@ class ParseFile:
         input_text = chunk
         
         # Ensure we're working with the properly formatted text from desired_output.txt
-        formatted = self.getdesiredchunk(self.deformat(formatted))
+        formatted = self.getdesiredchunk(' '.join(self.input_words(formatted)))
         
         # Properly escape newlines and ensure consistent formatting
         output_text = formatted.replace('\n', '\n')
@@ -209,24 +510,47 @@ class ParseFile:
         json_str = json.dumps(entry, ensure_ascii=False, separators=(', ', ': '))
         
         # Check for existing content to avoid duplicates
-        existing_content = []
-        if os.path.exists(TRAINING_FILE):
-            with open(TRAINING_FILE, 'r', encoding='utf-8') as f:
-                existing_content = [line.strip() for line in f.readlines() if line.strip()]
-        
+        if self.training_hashes is None:
+            self.training_hashes = self.load_training_hashes()
+
         # Only write if this exact entry doesn't exist
-        if json_str not in existing_content:
-            with open(TRAINING_FILE, 'a', encoding='utf-8') as f:
-                f.write(json_str + '\n')
+        digest = self.line_hash(json_str)
+        if digest not in self.training_hashes:
+            self.training_hashes.add(digest)
+            self.training_buffer.append(json_str)
+            if len(self.training_buffer) >= TRAINING_BATCH_SIZE:
+                self.flush_training_pairs()
+
+    def line_hash(self, line):
+        return hashlib.sha1(line.encode('utf-8')).digest()
+
+    def load_training_hashes(self):
+        """Reads the training file once and keeps a hash of every entry for dedup."""
+        hashes = set()
+        if os.path.exists(self.training_file):
+            with open(self.training_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        hashes.add(self.line_hash(line))
+        return hashes
+
+    def flush_training_pairs(self):
+        if not self.training_buffer:
+            return
+        with open(self.training_file, 'a', encoding='utf-8') as f:
+            f.write('\n'.join(self.training_buffer) + '\n')
+        self.training_buffer = []
 
     async def format(self, text):
         formatted = ""
         chunk = self.deformat(text)
-        match TEST_MODE:
+        match self.mode:
             case "unformatted":
                 formatted = chunk
             case "desiredoutput":
-                formatted = self.getdesiredchunk(chunk)
+                with self.metrics.time("getdesiredchunk"):
+                    formatted = self.getdesiredchunk(chunk)
                 self.generateIOpair(chunk, formatted)
             case "run":
                 formatted = await self.formatchunk(chunk)
@@ -260,84 +584,340 @@ class ParseFile:
             
         return first_part.rstrip(), second_part
 
-    async def process(self, input_file: str):
-        self.input_string = self.preprocess(input_file)
+    def join_overlap(self, overlap_part, next_chunk):
+        combined = overlap_part
+        if combined and next_chunk:
+            if not combined.endswith((' ', '\n')) and not next_chunk.startswith((' ', '\n')):
+                combined += ' '
+        combined += next_chunk
+        return combined
+
+    def iter_chunks(self, words, first_size, step_size):
+        """Yields the raw pieces each chunk consumes from a word stream. The first
+        piece fills a whole chunk; later pieces are appended to the overlap.
+        input_word_pointer counts the words handed out so far."""
+        if step_size <= 0:
+            raise ValueError("OUTPUT_CHUNK_SIZE must be larger than CHUNK_OVERLAP")
+        words = iter(words)
+        self.input_word_pointer = 0
+        piece = list(itertools.islice(words, first_size))
+        while True:
+            self.input_word_pointer += len(piece)
+            yield ' '.join(piece)
+            piece = list(itertools.islice(words, step_size))
+            if not piece:
+                return
+
+    def iter_token_chunks(self, words, counter, budget, overlap_size):
+        """
+        Yields raw pieces sized in model tokens rather than words. Each piece is
+        as large as fits in `budget` once the overlap carried in from the previous
+        chunk (its last `overlap_size` words) is counted, and holds at least one word.
+        """
+        self.input_word_pointer = 0
+        recent = collections.deque(maxlen=overlap_size)
+        piece = []
+        used = 0
+        limit = budget
+        for word in words:
+            cost = counter.word_tokens(word)
+            if piece and used + cost > limit:
+                self.input_word_pointer += len(piece)
+                yield ' '.join(piece)
+                piece = []
+                used = 0
+                limit = budget - sum(recent)
+            piece.append(word)
+            used += cost
+            if overlap_size:
+                recent.append(cost)
+        self.input_word_pointer += len(piece)
+        if piece or not self.input_word_pointer:
+            yield ' '.join(piece)
+
+    def split_point(self, context_window):
+        """
+        Number of formatted words committed from a chunk; the rest is carried as
+        overlap. Fixed chunks commit OUTPUT_CHUNK_SIZE words, so from the third
+        chunk on nothing is carried and only ADAPTIVE_CHUNKS keeps an overlap.
+        """
+        if ADAPTIVE_CHUNKS:
+            return max(0, len(context_window.split()) - CHUNK_OVERLAP)
+        return OUTPUT_CHUNK_SIZE
+
+    def trim_overlap(self, context_window, output_part, overlap_part):
+        """
+        Commits the sentences of the overlap that the model has confidently closed
+        (terminal punctuation followed by a line break) and carries over only the
+        text after the last one. Keeps the full overlap when no such boundary exists.
+        """
+        boundaries = list(SENTENCE_END.finditer(overlap_part))
+        if not boundaries:
+            return output_part, overlap_part
+        cut = len(context_window) - len(overlap_part) + boundaries[-1].end()
+        closed = overlap_part[:boundaries[-1].end()]
+        if self.token_counter is None:
+            self.token_counter = TokenCounter()
+        self.overlap_tokens_saved += sum(self.token_counter.word_tokens(word) for word in self.deformat(closed).split())
+        return context_window[:cut].strip(), overlap_part[boundaries[-1].end():].lstrip()
+
+    def predict_input(self, previous_input, next_chunk):
+        """Guesses a chunk's input before the previous chunk is formatted by
+        assuming formatting keeps the words and only adds punctuation."""
+        words = ' '.join(self.deformat(previous_input).split())
+        _, overlap_part = self.split_into_two_chunks(words, self.split_point(words))
+        return self.join_overlap(overlap_part, next_chunk)
+
+    def discard(self, task):
+        if task.done():
+            if not task.cancelled():
+                task.exception()
+        else:
+            task.cancel()
+
+    async def format_ahead(self, index, combined, upcoming, pending):
+        """
+        Formats chunk `index` while keeping up to `concurrency` requests in flight.
+        `upcoming` holds the raw pieces of the chunks after it.
+        Later chunks are sent early with predicted inputs; a prediction is only
+        used when it deformats to exactly the text the serial path would send.
+        """
+        task = None
+        speculated = pending.pop(index, None)
+        if speculated is not None:
+            text, task = speculated
+            if self.deformat(text) != self.deformat(combined):
+                self.logger.debug(f'Chunk {index} prediction missed, resending')
+                self.discard(task)
+                for later in pending.values():
+                    self.discard(later[1])
+                pending.clear()
+                task = None
+        if task is None:
+            task = asyncio.create_task(self.format(combined))
+
+        previous = combined
+        last = index + min(self.concurrency - 1, len(upcoming))
+        for ahead in range(index + 1, last + 1):
+            if ahead not in pending:
+                text = self.predict_input(previous, upcoming[ahead - index - 1])
+                pending[ahead] = (text, asyncio.create_task(self.format(text)))
+            previous = pending[ahead][0]
+
+        return await task
+
+    def write_words(self, path, words, batch_size=10000):
+        with open(path, "w", encoding='utf-8') as f:
+            separator = ''
+            while True:
+                batch = list(itertools.islice(words, batch_size))
+                if not batch:
+                    break
+                f.write(separator + ' '.join(batch))
+                separator = ' '
+
+    def run_settings(self, input_file):
+        return {
+            "input_file": os.path.abspath(input_file),
+            "input_bytes": os.path.getsize(input_file),
+            "chunk_size": OUTPUT_CHUNK_SIZE,
+            "adaptive": ADAPTIVE_CHUNKS,
+            "adaptive_overlap": ADAPTIVE_OVERLAP,
+            "overlap_size": CHUNK_OVERLAP,
+            "mode": self.mode
+        }
+
+    def save_checkpoint(self, input_file, chunk_index, input_word_pointer, output_state, context_window):
+        """
+        Records the run after chunk `chunk_index` has been formatted: the input word
+        pointer, how far the committed output file has been written and the formatted
+        context whose tail is the overlap for the next chunk. Written atomically so a
+        crash cannot corrupt it.
+        """
+        state = {
+            "settings": self.run_settings(input_file),
+            "chunk_index": chunk_index,
+            "input_word_pointer": input_word_pointer,
+            "output_state": output_state,
+            "context_window": context_window
+        }
+        directory = os.path.dirname(self.checkpoint_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.flush_training_pairs()
+        temp_file = self.checkpoint_file + '.tmp'
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_file, self.checkpoint_file)
+        self.logger.info(f'Checkpoint saved after chunk {chunk_index} (input pointer: {state["input_word_pointer"]})')
+
+    def load_checkpoint(self, input_file):
+        if not os.path.exists(self.checkpoint_file):
+            self.logger.info('No checkpoint found, starting from the beginning')
+            return None
+        with open(self.checkpoint_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get("settings") != self.run_settings(input_file):
+            raise ValueError(f"Checkpoint {self.checkpoint_file} was written for a different input or configuration")
+        self.logger.info(f'Resuming after chunk {state["chunk_index"]} (input pointer: {state["input_word_pointer"]})')
+        return state
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_file):
+            os.remove(self.checkpoint_file)
+
+    async def process(self, input_file: str, resume: bool = False, output_file: str = TEST_OUTPUT,
+                      checkpoint_file: str = CHECKPOINT_FILE, diagnostics: bool = True):
+        """
+        Formats input_file chunk by chunk. Each chunk's non-overlap portion is
+        appended to output_file as soon as it is final. With diagnostics the
+        preprocessed input is saved to TEST_INPUT and, in the unformatted and
+        desiredoutput modes, the result is compared with DESIRED_OUTPUT.
+        Returns the output path.
+        """
+        self.input_file = input_file
+        self.checkpoint_file = checkpoint_file
+        self.input_string = ""
+        self.input_array = []
+        self.desired_index = None
         self.cleanedinput_file = PROCESSED_FILE
         self.output_file = POSTPROCESSED_FILE
-            
+        pending = {}
+        completed = None
+        writer = None
+
         try:
-            input_string = self.input_string
-            output_string = ""
             context_window = ""
             chunk_size = OUTPUT_CHUNK_SIZE
             overlap_size = CHUNK_OVERLAP
             total_chunk_size = chunk_size + overlap_size
-                
-            first_chunk, remaining_input = self.split_into_two_chunks(input_string, total_chunk_size)
-            context_window = await self.format(first_chunk)
-                
-            while remaining_input.strip():
-                output_part, overlap_part = self.split_into_two_chunks(context_window, chunk_size)
-                
-                if output_string and not output_string.endswith((' ', '\n')):
-                    output_string += ' '
-                output_string += output_part
-                
-                next_chunk, remaining_input = self.split_into_two_chunks(
-                    remaining_input, 
-                    chunk_size - overlap_size
-                )
-                
-                if not next_chunk.strip() and not remaining_input.strip():
-                    break
-                
-                combined = overlap_part
-                if combined and next_chunk:
-                    if not combined.endswith((' ', '\n')) and not next_chunk.startswith((' ', '\n')):
-                        combined += ' '
-                combined += next_chunk
-                
-                context_window = await self.format(combined)
-
-            if output_string and not output_string.endswith((' ', '\n')):
-                output_string += ' '
-            output_string += context_window
-
-            
-            with open(TEST_INPUT, "w", encoding='utf-8') as f:
-                f.write(self.input_string)
 
-            with open(TEST_OUTPUT, "w", encoding='utf-8') as f:
-                f.write(output_string.strip())
-
-            if TEST_MODE == "unformatted":
-                with open(os.path.join("files", DESIRED_OUTPUT), "r", encoding='utf-8') as f:
+            if ADAPTIVE_CHUNKS:
+                counter = TokenCounter()
+                budget = counter.input_budget()
+                self.logger.info(f'Sizing chunks to {budget} input tokens')
+                chunks = self.iter_token_chunks(self.iter_words(input_file), counter, budget, overlap_size)
+            else:
+                chunks = self.iter_chunks(self.iter_words(input_file), total_chunk_size, chunk_size - overlap_size)
+            pipelined = self.mode == "run" and self.concurrency > 1
+            if pipelined and ADAPTIVE_OVERLAP:
+                # The trimmed overlap depends on where the model closes sentences, so
+                # predicted inputs would almost never match and every guess is wasted
+                self.logger.info('ADAPTIVE_OVERLAP is on, formatting chunks one at a time instead of ahead')
+                pipelined = False
+            upcoming = collections.deque()
+
+            index = -1
+            words_done = 0
+            state = self.load_checkpoint(input_file) if resume else None
+            if state:
+                for index in range(state["chunk_index"] + 1):
+                    next(chunks)
+                words_done = state["input_word_pointer"]
+                context_window = state["context_window"]
+            writer = OutputWriter(output_file, state["output_state"] if state else None)
+
+            while True:
+                upcoming.extend(itertools.islice(chunks, self.concurrency - len(upcoming)))
+                if not upcoming:
+                    break
+                next_chunk = upcoming.popleft()
+                words_done += len(next_chunk.split())
+                index += 1
+                if index == 0:
+                    combined = next_chunk
+                else:
+                    with self.metrics.time("split"):
+                        output_part, overlap_part = self.split_into_two_chunks(context_window, self.split_point(context_window))
+                        if ADAPTIVE_OVERLAP and overlap_part:
+                            output_part, overlap_part = self.trim_overlap(context_window, output_part, overlap_part)
+                    with self.metrics.time("write"):
+                        writer.append(output_part)
+                    combined = self.join_overlap(overlap_part, next_chunk)
+
+                with self.metrics.time("format"):
+                    if pipelined:
+                        context_window = await self.format_ahead(index, combined, upcoming, pending)
+                    else:
+                        context_window = await self.format(combined)
+
+                self.chunk_count = index + 1
+                self.metrics.count("chunks")
+                completed = (index, words_done, writer.state(), context_window)
+                if CHECKPOINT_INTERVAL and (index + 1) % CHECKPOINT_INTERVAL == 0:
+                    if not upcoming:
+                        upcoming.extend(itertools.islice(chunks, 1))
+                    if upcoming:
+                        self.save_checkpoint(input_file, *completed)
+
+            with self.metrics.time("write"):
+                writer.append(context_window)
+                writer.commit()
+
+            if diagnostics:
+                self.write_words(TEST_INPUT, self.iter_words(input_file))
+
+            if diagnostics and self.mode in ("unformatted", "desiredoutput"):
+                with open(output_file, "r", encoding='utf-8') as f:
+                    output_string = f.read()
+
+            if diagnostics and self.mode == "unformatted":
+                with open(self.desired_file, "r", encoding='utf-8') as f:
                     desiredcontent = f.read()
                 result = self.find_first_mismatch(desiredcontent, output_string)
                 print(result)
 
-            if TEST_MODE == "desiredoutput":
-                with open(os.path.join("files", DESIRED_OUTPUT), "r", encoding='utf-8') as f:
+            if diagnostics and self.mode == "desiredoutput":
+                with open(self.desired_file, "r", encoding='utf-8') as f:
                     desiredcontent = f.read()
                 result = self.find_first_mismatch(desiredcontent, output_string)
                 print(result)
 
-            return output_string.strip()
+            if diagnostics and self.mode in ("unformatted", "desiredoutput"):
+                print(quality.summary_line(quality.score(desiredcontent, output_string)))
+
+            if ADAPTIVE_OVERLAP:
+                self.logger.info(f'Adaptive overlap saved {self.overlap_tokens_saved} tokens')
+            if len(self.pool) > 1:
+                self.logger.info(f'Replicas: {self.pool.summary()}')
+            self.logger.info(f'Stage metrics: {self.metrics.report()}')
+            self.clear_checkpoint()
+            return output_file
 
         except Exception as e:
             self.logger.error(f'Processing failed: {e}', exc_info=True)
+            if completed and CHECKPOINT_INTERVAL:
+                self.save_checkpoint(input_file, *completed)
             raise
 
-async def main():
+        finally:
+            for _, task in pending.values():
+                self.discard(task)
+            self.flush_training_pairs()
+            if writer:
+                writer.close()
+
+async def main(resume: bool = False, metrics_file: str = METRICS_FILE,
+               prometheus_file: str = METRICS_PROMETHEUS_FILE):
     configure_logging()
     logger = logging.getLogger('main')
+    parser = ParseFile()
     try:
-        async with ParseFile() as parser:
-            await parser.process(TEST_FILE)
+        async with parser:
+            await parser.process(TEST_FILE, resume=resume)
         logger.info("Processing completed successfully")
     except Exception as e:
         logger.error(f"Processing failed: {str(e)}", exc_info=True)
         raise
+    finally:
+        parser.metrics.write(metrics_file, prometheus_file)
+        await http_client.close_session()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    arg_parser = argparse.ArgumentParser(description="Format TEST_FILE in chunks.")
+    arg_parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    arg_parser.add_argument("--metrics", default=METRICS_FILE, help="where the JSON stage metrics are written")
+    arg_parser.add_argument("--prometheus", default=METRICS_PROMETHEUS_FILE,
+                            help="also write the metrics in Prometheus text format to this file")
+    args = arg_parser.parse_args()
+    asyncio.run(main(resume=args.resume, metrics_file=args.metrics, prometheus_file=args.prometheus))
\ No newline at end of file
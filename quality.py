@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# quality.py
+import os
+import re
+import json
+import argparse
+import bisect
+import difflib
+from config import DESIRED_OUTPUT
+
+TOKEN = re.compile(r'(\S+)(\s*)')
+NON_LETTERS = re.compile(r'[^a-z]')
+TAIL = re.compile(r'[^a-zA-Z]*$')
+MARKS = '.,;:!?'
+DIFF_CELLS = 1 << 20   # Gaps larger than this (words x words) are anchored before diffing
+
+def tokenize(text):
+    """
+    Splits formatted text into its deformatted words (lowercase letters only,
+    as ParseFile.deformat leaves them), the punctuation mark that follows each
+    word ('' for none, the last of .,;:!? otherwise) and whether a line break,
+    i.e. a sentence break, separates it from the next word.
+    """
+    words = []
+    marks = []
+    breaks = bytearray()
+    newline = False
+    for token, space in TOKEN.findall(text):
+        word = NON_LETTERS.sub('', token.lower())
+        if word:
+            if newline and words:
+                breaks[-1] = 1
+            words.append(word)
+            tail = token[TAIL.search(token).start():]
+            marks.append(next((char for char in reversed(tail) if char in MARKS), ''))
+            breaks.append(0)
+            newline = '\n' in space
+        elif words:
+            mark = next((char for char in reversed(token) if char in MARKS), '')
+            if mark:
+                marks[-1] = mark
+            newline = newline or '\n' in space
+    return words, marks, breaks
+
+def align(reference_words, output_words):
+    """
+    Returns (reference index, output index) for every word the two sequences
+    share. Words are integer-encoded and aligned patience-style: the common
+    prefix and suffix are matched directly, words that occur exactly once on
+    both sides anchor the rest, and only the small gaps between anchors are
+    diffed with difflib. Book-length texts that mostly agree align in about
+    a second.
+    """
+    codes = {}
+    reference = [codes.setdefault(word, len(codes)) for word in reference_words]
+    output = [codes.setdefault(word, len(codes)) for word in output_words]
+    pairs = []
+    align_range(reference, output, 0, len(reference), 0, len(output), pairs)
+    return pairs
+
+def align_range(a, b, alo, ahi, blo, bhi, pairs):
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        pairs.append((alo, blo))
+        alo += 1
+        blo += 1
+    suffix = []
+    while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+        ahi -= 1
+        bhi -= 1
+        suffix.append((ahi, bhi))
+
+    if alo < ahi and blo < bhi:
+        large = (ahi - alo) * (bhi - blo) > DIFF_CELLS
+        anchors = unique_anchors(a, b, alo, ahi, blo, bhi) if large else []
+        if anchors:
+            for i, j in anchors:
+                align_range(a, b, alo, i, blo, j, pairs)
+                pairs.append((i, j))
+                alo, blo = i + 1, j + 1
+            align_range(a, b, alo, ahi, blo, bhi, pairs)
+        else:
+            matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=large)
+            for i, j, size in matcher.get_matching_blocks():
+                pairs.extend(zip(range(alo + i, alo + i + size), range(blo + j, blo + j + size)))
+    pairs.extend(reversed(suffix))
+
+def unique_anchors(a, b, alo, ahi, blo, bhi):
+    """Longest increasing run of positions of the words found exactly once in both ranges."""
+    def unique_positions(sequence, lo, hi):
+        positions = {}
+        repeated = set()
+        for index in range(lo, hi):
+            if sequence[index] in positions:
+                repeated.add(sequence[index])
+            else:
+                positions[sequence[index]] = index
+        return {code: index for code, index in positions.items() if code not in repeated}
+
+    in_b = unique_positions(b, blo, bhi)
+    matches = [(i, in_b[code]) for code, i in unique_positions(a, alo, ahi).items() if code in in_b]
+
+    tails = []
+    tail_matches = []
+    previous = [None] * len(matches)
+    for k, (_, j) in enumerate(matches):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_matches.append(k)
+        else:
+            tails[position] = j
+            tail_matches[position] = k
+        previous[k] = tail_matches[position - 1] if position else None
+
+    anchors = []
+    k = tail_matches[-1] if tail_matches else None
+    while k is not None:
+        anchors.append(matches[k])
+        k = previous[k]
+    return anchors[::-1]
+
+def rates(true_positives, false_positives, false_negatives):
+    precision = true_positives / (true_positives + false_positives) if true_positives + false_positives else 0.0
+    recall = true_positives / (true_positives + false_negatives) if true_positives + false_negatives else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "precision": round(precision, 4),
+        "recall": round(recall, 4),
+        "f1": round(f1, 4),
+        "tp": true_positives,
+        "fp": false_positives,
+        "fn": false_negatives
+    }
+
+def score(reference_text, output_text):
+    """
+    Aligns output_text with reference_text word by word and scores the
+    punctuation marks and sentence breaks of the aligned words. A wrong mark
+    counts as both a false positive and a false negative. Words that do not
+    align are reported but not scored.
+    """
+    reference_words, reference_marks, reference_breaks = tokenize(reference_text)
+    output_words, output_marks, output_breaks = tokenize(output_text)
+
+    counts = {mark: [0, 0, 0] for mark in MARKS}
+    punctuation = [0, 0, 0]
+    sentence_breaks = [0, 0, 0]
+    aligned = 0
+    for i, j in align(reference_words, output_words):
+        aligned += 1
+        expected = reference_marks[i]
+        found = output_marks[j]
+        if expected == found:
+            if expected:
+                punctuation[0] += 1
+                counts[expected][0] += 1
+        else:
+            if found:
+                punctuation[1] += 1
+                counts[found][1] += 1
+            if expected:
+                punctuation[2] += 1
+                counts[expected][2] += 1
+        if reference_breaks[i] and output_breaks[j]:
+            sentence_breaks[0] += 1
+        elif output_breaks[j]:
+            sentence_breaks[1] += 1
+        elif reference_breaks[i]:
+            sentence_breaks[2] += 1
+
+    return {
+        "words": {
+            "reference": len(reference_words),
+            "output": len(output_words),
+            "aligned": aligned,
+            "coverage": round(aligned / len(reference_words), 4) if reference_words else 0.0
+        },
+        "punctuation": rates(*punctuation),
+        "sentence_breaks": rates(*sentence_breaks),
+        "marks": {mark: rates(*counts[mark]) for mark in MARKS if any(counts[mark])}
+    }
+
+def score_files(reference_file, output_file):
+    with open(reference_file, 'r', encoding='utf-8') as f:
+        reference_text = f.read()
+    with open(output_file, 'r', encoding='utf-8') as f:
+        output_text = f.read()
+    return score(reference_text, output_text)
+
+def summary_line(result):
+    words = result["words"]
+    punctuation = result["punctuation"]
+    breaks = result["sentence_breaks"]
+    return (f'aligned {words["aligned"]}/{words["reference"]} words; '
+            f'punctuation P {punctuation["precision"]:.3f} R {punctuation["recall"]:.3f} F1 {punctuation["f1"]:.3f}; '
+            f'sentence breaks P {breaks["precision"]:.3f} R {breaks["recall"]:.3f} F1 {breaks["f1"]:.3f}')
+
+def main():
+    parser = argparse.ArgumentParser(description="Score formatted output against a reference formatting.")
+    parser.add_argument("output", help="formatted output to score")
+    parser.add_argument("reference", nargs="?", default=os.path.join("files", DESIRED_OUTPUT),
+                        help="correctly formatted text (default: files/DESIRED_OUTPUT)")
+    parser.add_argument("--json", action="store_true", help="print the full result as JSON")
+    args = parser.parse_args()
+
+    result = score_files(args.reference, args.output)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(summary_line(result))
+    for mark, counts in result["marks"].items():
+        print(f'  {mark}  P {counts["precision"]:.3f} R {counts["recall"]:.3f} F1 {counts["f1"]:.3f} '
+              f'(tp {counts["tp"]}, fp {counts["fp"]}, fn {counts["fn"]})')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# replica_pool.py
+import time
+import logging
+import contextlib
+from urllib.parse import urlsplit, urlunsplit
+from config import REPLICA_EJECT_AFTER, REPLICA_EJECT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+def replica_urls(api_url, replicas: int = 1):
+    """
+    Returns the completions URLs of `replicas` servers on consecutive ports,
+    starting at api_url's, as startlora.py --replicas launches them. A list of
+    URLs is returned unchanged.
+    """
+    if isinstance(api_url, (list, tuple)):
+        return list(api_url)
+    if replicas <= 1:
+        return [api_url]
+    parts = urlsplit(api_url)
+    if parts.port is None:
+        raise ValueError(f"API URL needs an explicit port for {replicas} replicas: {api_url}")
+    urls = []
+    for offset in range(replicas):
+        netloc = f'{parts.hostname}:{parts.port + offset}'
+        urls.append(urlunsplit((parts.scheme, netloc, parts.path, parts.query, parts.fragment)))
+    return urls
+
+class Replica:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+
+class ReplicaPool:
+    """
+    Spreads completions requests over several servers. Each request goes to the
+    healthy replica with the fewest requests outstanding (ties go to the one
+    with fewer recent failures, then fewer requests). A replica that fails
+    eject_after requests in a row is ejected for eject_seconds; after that it
+    is tried again and ejected at its next failure until one succeeds. When
+    every replica is ejected, the one due back first is used anyway so the
+    caller's retries still get through.
+    """
+
+    def __init__(self, urls, eject_after: int = REPLICA_EJECT_AFTER, eject_seconds: float = REPLICA_EJECT_SECONDS):
+        if not urls:
+            raise ValueError("A replica pool needs at least one URL")
+        self.replicas = [Replica(url) for url in urls]
+        self.eject_after = max(1, eject_after)
+        self.eject_seconds = eject_seconds
+
+    def __len__(self):
+        return len(self.replicas)
+
+    def choose(self) -> Replica:
+        now = time.monotonic()
+        healthy = [replica for replica in self.replicas if replica.ejected_until <= now]
+        if not healthy:
+            return min(self.replicas, key=lambda replica: replica.ejected_until)
+        return min(healthy, key=lambda replica: (replica.outstanding, replica.consecutive_failures, replica.requests))
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        """
+        Yields the URL of the replica a request should go to and records the
+        outcome. Exceptions marked `retryable = False` (client errors) do not
+        count against the replica.
+        """
+        replica = self.choose()
+        replica.outstanding += 1
+        replica.requests += 1
+        try:
+            yield replica.url
+        except Exception as e:
+            if getattr(e, "retryable", True):
+                self.failed(replica)
+            raise
+        else:
+            replica.consecutive_failures = 0
+        finally:
+            replica.outstanding -= 1
+
+    def failed(self, replica: Replica):
+        replica.errors += 1
+        replica.consecutive_failures += 1
+        if len(self.replicas) > 1 and replica.consecutive_failures >= self.eject_after:
+            replica.ejections += 1
+            replica.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(f'Ejecting {replica.url} for {self.eject_seconds}s after '
+                           f'{replica.consecutive_failures} consecutive failures')
+
+    def summary(self):
+        return [
+            {"url": replica.url, "requests": replica.requests, "errors": replica.errors,
+             "ejections": replica.ejections}
+            for replica in self.replicas
+        ]
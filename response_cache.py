@@ -0,0 +1,117 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+from typing import Optional
+
+from config import MODEL_NAME, RESPONSE_CACHE_FILE, RESPONSE_CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    On-disk cache of formatted chunks keyed by a hash of the model and the full
+    completions request (prompt and sampling parameters). ParseFile passes the
+    model the server reports serving, base model and LoRAs with their adapter
+    fingerprints (model_loader.served_model), so switching or retraining an
+    adapter never returns another adapter's output. Entries are evicted least
+    recently used first once the cache exceeds max_bytes.
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_FILE, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 model: str = MODEL_NAME):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.model = model
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, output TEXT NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.db.commit()
+
+    def key(self, payload: dict) -> str:
+        content = json.dumps({"model": self.model, "request": payload}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def get(self, payload: dict) -> Optional[str]:
+        key = self.key(payload)
+        row = self.db.execute("SELECT output FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        self.db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.db.commit()
+        return row[0]
+
+    def put(self, payload: dict, output: str):
+        size = len(output.encode('utf-8'))
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses (key, model, output, size, last_used) VALUES (?, ?, ?, ?, ?)",
+            (self.key(payload), self.model, output, size, time.time())
+        )
+        self.evict()
+        self.db.commit()
+
+    def size(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def evict(self):
+        total = self.size()
+        if total <= self.max_bytes:
+            return
+        rows = self.db.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        logger.debug(f'Evicted {len(evicted)} cached responses')
+
+    def invalidate(self, model: Optional[str] = None) -> int:
+        """
+        Drops every entry for `model`, a base model name or a full served model
+        description (all models when None). Returns the count removed.
+        """
+        if model is None:
+            cursor = self.db.execute("DELETE FROM responses")
+        else:
+            cursor = self.db.execute(
+                "DELETE FROM responses WHERE model = ? OR substr(model, 1, ?) = ?",
+                (model, len(model) + 1, model + '|')
+            )
+        self.db.commit()
+        return cursor.rowcount
+
+    def close(self):
+        self.db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or invalidate the formatchunk response cache.")
+    parser.add_argument("--invalidate", metavar="MODEL", help="remove cached responses for MODEL")
+    parser.add_argument("--clear", action="store_true", help="remove all cached responses")
+    args = parser.parse_args()
+
+    cache = ResponseCache()
+    try:
+        if args.clear:
+            print(f"Removed {cache.invalidate()} cached responses")
+        elif args.invalidate:
+            print(f"Removed {cache.invalidate(args.invalidate)} cached responses for {args.invalidate}")
+        else:
+            count = cache.db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            print(f"{count} cached responses, {cache.size()} bytes (limit {cache.max_bytes})")
+    finally:
+        cache.close()
+
+if __name__ == "__main__":
+    main()
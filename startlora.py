@@ -1,11 +1,14 @@
 #!/usr/bin/env python3
-import subprocess
 import os
+import re
+import asyncio
+import argparse
 import time
 from pathlib import Path
 import signal
 import sys
 import logging
+import aiohttp
 
 # Configure logging
 logging.basicConfig(
@@ -24,11 +27,18 @@ CONFIG = {
     'lora_dir': '/home/kdog/pythonprojects/process_transcript/training/datasets/model-out',
     'webui_dir': '/home/kdog/text-generation-webui',
     'listen_port': 5001,
+    'api_port': 5000,           # The OpenAI API port; API_URL in config.py points here
+    'replicas': 1,              # Servers started on consecutive ports (--replicas)
+    'pin_cpus': True,           # Give each replica its own slice of the CPUs
+    'host': '127.0.0.1',        # Address readiness probes connect to
     'timeout': 300,
+    'poll_interval': 0.25,      # First delay between readiness probes, doubled up to poll_max_interval
+    'poll_max_interval': 1.0,
     'venv_dir': '/home/kdog/text-generation-webui/venv'
 }
 
-server_process = None
+server_processes = []
+drain_tasks = []
 
 def validate_paths():
     """Verify all required paths and files exist"""
@@ -59,103 +69,213 @@ def validate_paths():
     if missing:
         raise FileNotFoundError("\n".join(missing))
 
-def start_server():
-    """Start the server with the correct LORA path"""
-    global server_process
-    
+def build_command(python_exec, port, api_port, threads=None):
+    # Convert LORA path to absolute and ensure it's a string
+    lora_path = str(Path(CONFIG['lora_dir']).absolute())
+    cmd = [
+        python_exec, "server.py",
+        "--model", CONFIG['base_model'],
+        "--lora", lora_path,
+        "--lora-dir", str(Path(CONFIG['lora_dir']).parent.absolute()),
+        "--listen",
+        "--api",
+        "--listen-port", str(port),
+        "--api-port", str(api_port),
+        "--verbose",
+        "--nowebui"  # Remove if you want the web interface
+    ]
+    if threads:
+        cmd += ["--threads", str(threads)]
+    return cmd
+
+def cpu_slices(replicas):
+    """
+    Splits the CPUs this process may use into one contiguous slice per replica,
+    so replicas on a multi-socket box do not compete for the same cores. None
+    per replica when there is only one or affinity cannot be set.
+    """
+    if replicas <= 1 or not CONFIG['pin_cpus'] or not hasattr(os, 'sched_setaffinity'):
+        return [None] * replicas
+    cpus = sorted(os.sched_getaffinity(0))
+    if len(cpus) < replicas:
+        logger.warning(f"Only {len(cpus)} CPUs for {replicas} replicas, not pinning")
+        return [None] * replicas
+    size, extra = divmod(len(cpus), replicas)
+    slices = []
+    start = 0
+    for index in range(replicas):
+        end = start + size + (1 if index < extra else 0)
+        slices.append(cpus[start:end])
+        start = end
+    return slices
+
+async def drain(stream, level, prefix=""):
+    """
+    Logs every line of a child pipe as it arrives so the pipe can never fill up.
+    Reads raw blocks rather than lines: progress bars redraw with "\r" and no
+    "\n", which would overrun the StreamReader's line limit, so both end a line
+    here; a longer run without either is logged in pieces. A line that fails
+    to log is skipped and draining goes on.
+    """
+    pending = b''
+    while True:
+        block = await stream.read(65536)
+        pending += block
+        lines = re.split(rb'[\r\n]', pending)
+        pending = lines.pop() if block else b''
+        if len(pending) >= 65536:
+            lines.append(pending)
+            pending = b''
+        for line in lines:
+            try:
+                line = line.decode('utf-8', errors='replace').strip()
+                if line:
+                    logger.log(level, prefix + line)
+            except Exception as e:
+                logger.debug(f'Could not log server output: {e}')
+        if not block:
+            return
+
+async def wait_until_ready(process, url, timeout):
+    """
+    Polls url (the server's /v1/models) with exponential backoff until it answers
+    200, and returns the seconds it took. Fails as soon as the process exits.
+    """
+    start_time = time.monotonic()
+    interval = CONFIG['poll_interval']
+    async with aiohttp.ClientSession() as session:
+        while True:
+            if process.returncode is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode} before it was ready")
+            try:
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=interval + 1)) as response:
+                    if response.status == 200:
+                        return time.monotonic() - start_time
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            elapsed = time.monotonic() - start_time
+            if elapsed >= timeout:
+                raise RuntimeError(f"Server failed to start within {timeout} seconds")
+            await asyncio.sleep(min(interval, timeout - elapsed))
+            interval = min(interval * 2, CONFIG['poll_max_interval'])
+
+async def start_replica(python_exec, index, cpus):
+    """Starts replica `index` on listen_port + index / api_port + index and waits until it answers"""
+    api_port = CONFIG['api_port'] + index
+    cmd = build_command(python_exec, CONFIG['listen_port'] + index, api_port, len(cpus) if cpus else None)
+    logger.info(f"Starting server in {CONFIG['webui_dir']} with command:\n{' '.join(cmd)}")
+    if cpus:
+        logger.info(f"Replica {index} pinned to CPUs {cpus[0]}-{cpus[-1]}")
+
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        cwd=CONFIG['webui_dir'],
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        preexec_fn=(lambda: os.sched_setaffinity(0, cpus)) if cpus else None
+    )
+    server_processes.append(process)
+    # Drain both pipes concurrently; the server's log goes to stderr
+    prefix = f"[{api_port}] " if CONFIG['replicas'] > 1 else ""
+    drain_tasks.extend([
+        asyncio.create_task(drain(process.stdout, logging.INFO, prefix)),
+        asyncio.create_task(drain(process.stderr, logging.INFO, prefix))
+    ])
+
+    url = f"http://{CONFIG['host']}:{api_port}/v1/models"
+    seconds = await wait_until_ready(process, url, CONFIG['timeout'])
+    logger.info(f"✅ Server ready at {url} after {seconds:.1f}s")
+
+async def start_server():
+    """Start CONFIG['replicas'] servers with the correct LORA path on consecutive ports"""
     try:
         python_exec = str(Path(CONFIG['venv_dir']) / 'bin' / 'python')
         if not Path(python_exec).exists():
             raise FileNotFoundError(f"Python executable not found: {python_exec}")
-        
-        os.chdir(CONFIG['webui_dir'])
-        logger.info(f"Changed to directory: {CONFIG['webui_dir']}")
-        
-        # Convert LORA path to absolute and ensure it's a string
-        lora_path = str(Path(CONFIG['lora_dir']).absolute())
-        
-        cmd = [
-            python_exec, "server.py",
-            "--model", CONFIG['base_model'],
-            "--lora", lora_path,
-            "--lora-dir", str(Path(CONFIG['lora_dir']).parent.absolute()),
-            "--listen",
-            "--api",
-            "--listen-port", str(CONFIG['listen_port']),
-            "--verbose",
-            "--nowebui"  # Remove if you want the web interface
-        ]
-        
-        logger.info(f"Starting server with command:\n{' '.join(cmd)}")
-        
-        server_process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
-        
-        # Monitor output
-        start_time = time.time()
-        server_ready = False
-        
-        while time.time() - start_time < CONFIG['timeout']:
-            if server_process.poll() is not None:
-                break
-                
-            for line in server_process.stdout:
-                line = line.strip()
-                if line:
-                    logger.info(line)
-                    if "API is running" in line or "Loaded the model" in line:
-                        server_ready = True
-                        break
-            
-            for line in server_process.stderr:
-                line = line.strip()
-                if line:
-                    logger.error(line)
-            
-            if server_ready:
-                break
-                
-            time.sleep(0.1)
-        
-        if not server_ready:
-            raise RuntimeError(f"Server failed to start within {CONFIG['timeout']} seconds")
-            
-        logger.info("✅ Server started successfully!")
+
+        replicas = CONFIG['replicas']
+        await asyncio.gather(*(
+            start_replica(python_exec, index, cpus)
+            for index, cpus in enumerate(cpu_slices(replicas))
+        ))
+        if replicas > 1:
+            last_port = CONFIG['api_port'] + replicas - 1
+            logger.info(f"Set API_REPLICAS = {replicas} in config.py to balance across ports "
+                        f"{CONFIG['api_port']}-{last_port}")
         return True
-        
+
     except Exception as e:
         logger.error(f"❌ Failed to start server: {str(e)}")
-        stop_server()
+        await stop_server()
         return False
 
-def stop_server():
-    """Stop the server process"""
-    global server_process
-    if server_process:
-        logger.info("🛑 Stopping server...")
-        server_process.terminate()
+async def stop_process(process):
+    if process.returncode is None:
+        process.terminate()
         try:
-            server_process.wait(timeout=10)
-        except subprocess.TimeoutExpired:
-            server_process.kill()
-        server_process = None
+            await asyncio.wait_for(process.wait(), timeout=10)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+async def stop_server():
+    """Stop every server process"""
+    global server_processes, drain_tasks
+    if server_processes:
+        if any(process.returncode is None for process in server_processes):
+            logger.info("🛑 Stopping server...")
+        await asyncio.gather(*(stop_process(process) for process in server_processes))
+        await asyncio.gather(*drain_tasks, return_exceptions=True)
+        server_processes = []
+        drain_tasks = []
         logger.info("Server stopped.")
 
-def signal_handler(sig, frame):
-    """Handle interrupt signal"""
-    logger.info("\nReceived interrupt signal")
-    stop_server()
-    sys.exit(0)
+async def watch(process, api_port):
+    code = await process.wait()
+    logger.warning(f"Server on port {api_port} exited with code {code}")
+
+async def watch_all():
+    await asyncio.gather(*(
+        watch(process, CONFIG['api_port'] + index) for index, process in enumerate(server_processes)
+    ))
+
+async def run():
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    stopped = asyncio.create_task(stop.wait())
+
+    try:
+        # An interrupt while the models are still loading cancels the startup
+        starting = asyncio.create_task(start_server())
+        await asyncio.wait({starting, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not starting.done():
+            starting.cancel()
+            logger.info("\nReceived interrupt signal")
+            return True
+        if not starting.result():
+            return False
+
+        # Run until interrupted or until every server has exited on its own;
+        # the dispatcher ejects a replica that dies in the meantime
+        exited = asyncio.create_task(watch_all())
+        await asyncio.wait({exited, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if stopped.done():
+            logger.info("\nReceived interrupt signal")
+        exited.cancel()
+        return True
+    finally:
+        stopped.cancel()
+        await stop_server()
 
 def main():
-    signal.signal(signal.SIGINT, signal_handler)
-    
+    parser = argparse.ArgumentParser(description="Start text-generation-webui with the trained LoRA.")
+    parser.add_argument("--replicas", type=int, default=CONFIG['replicas'],
+                        help="servers to start on consecutive ports (match API_REPLICAS in config.py)")
+    args = parser.parse_args()
+    CONFIG['replicas'] = max(1, args.replicas)
+
     logger.info("🔍 Validating paths...")
     try:
         validate_paths()
@@ -163,17 +283,9 @@ def main():
     except Exception as e:
         logger.error(f"❌ Validation failed: {str(e)}")
         sys.exit(1)
-    
-    if start_server():
-        try:
-            while server_process and server_process.poll() is None:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            pass
-        finally:
-            stop_server()
-    else:
+
+    if not asyncio.run(run()):
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
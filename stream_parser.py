@@ -0,0 +1,100 @@
+# stream_parser.py
+import re
+
+OUTPUT_KEY = re.compile(r'"output"\s*:\s*"')
+ESCAPES = {'"': '"', '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+
+class StreamingOutput:
+    """
+    Incrementally decodes the "output" string of the model's JSON reply while
+    tokens stream in, and compares its words with the chunk's input words.
+
+    feed() returns one of:
+      "continue" - keep reading
+      "complete" - the output string has been closed
+      "covered"  - the output already holds every input word; the rest is runaway
+      "drift"    - the output words no longer match the input words
+    """
+
+    def __init__(self, input_words, deformat, check_drift=True):
+        self.input_words = input_words
+        self.deformat = deformat
+        self.check_drift = check_drift
+        self.raw = ""
+        self.position = None
+        self.text = ""
+        self.scan = 0
+        self.words = 0
+        self.cut = None
+        self.state = "continue"
+
+    def feed(self, text):
+        if self.state != "continue":
+            return self.state
+        self.raw += text
+        if self.position is None:
+            match = OUTPUT_KEY.search(self.raw)
+            if not match:
+                return self.state
+            self.position = match.end()
+        closed = self.decode()
+        self.check_words(closed)
+        if closed and self.state == "continue":
+            self.state = "complete"
+        return self.state
+
+    def decode(self):
+        """Appends the newly streamed part of the output string; True once it is closed."""
+        raw = self.raw
+        i = self.position
+        decoded = []
+        closed = False
+        while i < len(raw):
+            char = raw[i]
+            if char == '"':
+                closed = True
+                i += 1
+                break
+            if char != '\\':
+                decoded.append(char)
+                i += 1
+                continue
+            if i + 1 >= len(raw):
+                break
+            code = raw[i + 1]
+            if code == 'u':
+                if i + 6 > len(raw):
+                    break
+                decoded.append(chr(int(raw[i + 2:i + 6], 16)))
+                i += 6
+            else:
+                decoded.append(ESCAPES.get(code, code))
+                i += 2
+        self.position = i
+        self.text += ''.join(decoded)
+        return closed
+
+    def check_words(self, closed):
+        """Compares every newly finished output word with the next input word."""
+        start = self.scan
+        for token in re.finditer(r'\S+', self.text[start:]):
+            end = start + token.end()
+            if end == len(self.text) and not closed:
+                return
+            for word in self.deformat(token.group()).split():
+                if self.words >= len(self.input_words) or (
+                        self.check_drift and word != self.input_words[self.words]):
+                    self.state = "drift"
+                    return
+                self.words += 1
+            self.scan = end
+            if self.words == len(self.input_words) and not closed:
+                self.cut = end
+                self.state = "covered"
+                return
+
+    def result(self):
+        """The decoded output, cut after the last input word when generation ran on."""
+        if self.state == "covered":
+            return self.text[:self.cut]
+        return self.text
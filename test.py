@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
-import requests
+import asyncio
 import json
+import http_client
 
 API_URL = "http://localhost:5000/v1/completions"
 HEADERS = {"Content-Type": "application/json"}
 
-def generate_punctuation(text):
+async def generate_punctuation(text):
     """Generate properly punctuated text using the API with the exact training prompt format"""
     prompt = f"Punctuate sentences. {text}"
     
@@ -19,9 +20,10 @@ def generate_punctuation(text):
     }
     
     try:
-        response = requests.post(API_URL, headers=HEADERS, json=payload)
-        response.raise_for_status()
-        result = response.json()
+        session = await http_client.get_session()
+        async with session.post(API_URL, headers=HEADERS, json=payload) as response:
+            response.raise_for_status()
+            result = await response.json()
         
         # The full response will be "Punctuate sentences. [original] [punctuated]"
         # So we need to extract just the punctuated part
@@ -38,7 +40,7 @@ def generate_punctuation(text):
     except Exception as e:
         return f"Error: {str(e)}"
 
-def main():
+async def main():
     test_cases = [
         "i cant believe its not butter",
         "the meeting is at 3pm tomorrow dont forget",
@@ -55,11 +57,11 @@ def main():
     print("\nTesting punctuation via API:")
     print("-" * 60)
     
-    for text in test_cases:
+    results = await asyncio.gather(*(generate_punctuation(text) for text in test_cases))
+    for text, corrected in zip(test_cases, results):
         print(f"\nOriginal: {text}")
-        corrected = generate_punctuation(text)
         print(f"Corrected: {corrected}")
         print("-" * 60)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    http_client.run(main())
\ No newline at end of file
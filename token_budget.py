@@ -0,0 +1,67 @@
+# token_budget.py
+import os
+import json
+import logging
+from config import (
+    TOKENIZER_DIR, CONTEXT_WINDOW, MAX_TOKENS, OUTPUT_TOKEN_RATIO, TOKEN_MARGIN, CHARS_PER_TOKEN
+)
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+try:
+    import sentencepiece
+except ImportError:
+    sentencepiece = None
+
+logger = logging.getLogger(__name__)
+
+class TokenCounter:
+    """
+    Counts tokens with the model's own tokenizer from TOKENIZER_DIR, using
+    tokenizer.json (tokenizers) or tokenizer.model (sentencepiece), whichever
+    can be loaded. Falls back to a characters-per-token estimate otherwise.
+    """
+
+    def __init__(self, tokenizer_dir: str = TOKENIZER_DIR):
+        self.encode = self.load(tokenizer_dir)
+        self.word_counts = {}
+
+    def load(self, tokenizer_dir):
+        tokenizer_json = os.path.join(tokenizer_dir, 'tokenizer.json')
+        if Tokenizer is not None and os.path.exists(tokenizer_json):
+            tokenizer = Tokenizer.from_file(tokenizer_json)
+            logger.info(f'Counting tokens with {tokenizer_json}')
+            return lambda text: len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+        tokenizer_model = os.path.join(tokenizer_dir, 'tokenizer.model')
+        if sentencepiece is not None and os.path.exists(tokenizer_model):
+            processor = sentencepiece.SentencePieceProcessor(model_file=tokenizer_model)
+            logger.info(f'Counting tokens with {tokenizer_model}')
+            return lambda text: len(processor.encode(text))
+
+        logger.warning(f'No usable tokenizer in {tokenizer_dir}, estimating {CHARS_PER_TOKEN} characters per token')
+        return lambda text: -(-len(text) // CHARS_PER_TOKEN)
+
+    def count(self, text: str) -> int:
+        return self.encode(text)
+
+    def word_tokens(self, word: str) -> int:
+        """Tokens for a single word, cached since words repeat throughout a document."""
+        count = self.word_counts.get(word)
+        if count is None:
+            count = self.word_counts[word] = self.count(word)
+        return count
+
+    def input_budget(self) -> int:
+        """
+        Largest number of input tokens a chunk may hold: the prompt and the
+        generated output must fit in CONTEXT_WINDOW, and the output, estimated at
+        OUTPUT_TOKEN_RATIO tokens per input token, must fit in MAX_TOKENS.
+        """
+        template = json.dumps({"instruction": "Punctuate sentences.", "input": "", "output": ""})
+        by_context = CONTEXT_WINDOW - MAX_TOKENS - self.count(template)
+        by_output = MAX_TOKENS / OUTPUT_TOKEN_RATIO
+        return max(1, int(min(by_context, by_output) * TOKEN_MARGIN))